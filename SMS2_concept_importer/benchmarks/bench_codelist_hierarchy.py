@@ -0,0 +1,46 @@
+"""Measures how ordering codelist entries scales with the number of entries and the depth of the tree.
+
+Usage:
+    python SMS2_concept_importer/benchmarks/bench_codelist_hierarchy.py [--sizes 1000 10000 100000] [--depths 1 3 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from codelist_hierarchy import CodeListHierarchy  # noqa: E402
+from synthetic_data import generate_entries  # noqa: E402
+
+
+def run(sizes, depths, repeat: int):
+    print(f"{'entries':>10} {'depth':>6} {'best s':>10} {'entries/s':>12}")
+    results = []
+    for size in sizes:
+        for depth in depths:
+            if depth > size:
+                continue
+            entries = generate_entries(size, depth)
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                sorted_entries = CodeListHierarchy(entries).sorted_entries()
+                best = min(best, time.perf_counter() - start)
+            assert len(sorted_entries) == size
+            print(f"{size:>10} {depth:>6} {best:>10.4f} {size / best:>12,.0f}")
+            results.append({"entries": size, "depth": depth, "seconds": best})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 500_000])
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 3, 8, 20])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.depths, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""End-to-end migration throughput and per-stage latency against a local stand-in of the APIs.
+
+Generates a synthetic SMS2 catalogue (flat or deep code lists of the given sizes), serves it from
+replay_server.StandInServer and migrates every DV through the same functions as SMS2_batch_migration.py.
+Reports DVs/s, p50/p95/p99 latency per stage and peak RSS, and stores the results as JSON so runs of
+different commits can be compared.
+
+Usage:
+    python SMS2_concept_importer/benchmarks/bench_migration.py --dvs 200 --codelist-sizes 10 1000 100000 --depth 4
+    python SMS2_concept_importer/benchmarks/bench_migration.py --compare SMS2_concept_importer/benchmarks/results/<previous>.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import api_client  # noqa: E402
+import codelist_cache  # noqa: E402
+import instrumentation  # noqa: E402
+import SMS2_batch_migration as batch  # noqa: E402
+import SMS2_concept_importer as importer  # noqa: E402
+from person_resolver import PersonResolver  # noqa: E402
+from replay_server import StandInServer, start_server, JSON  # noqa: E402
+from synthetic_data import generate_catalogue  # noqa: E402
+
+RESULTS_DIR = os.path.join(HERE, "results")
+STAGES = ["get_DV", "get_CL", "get_CLE", "sort_codelist_entries", "map_DV", "ensure_users", "post_concept",
+          "post_codelist_entries", "put_registrationStatus", "put_publicationLevel", "total"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageTimer:
+    """Collects the duration of every call of the wrapped functions, per stage."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage: str, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for stage in STAGES:
+            values = self.samples.get(stage)
+            if not values:
+                continue
+            result[stage] = {
+                "count": len(values),
+                "total_s": round(sum(values), 4),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+        return result
+
+
+def install_sms2_routes(server: StandInServer, catalogue: Dict[str, Any]):
+    """Serves the synthetic DVs and code lists like the SMS2 API. Bodies are serialized once and reused."""
+    bodies: Dict[str, str] = {}
+    lock = threading.Lock()
+
+    def cached_body(key: str, build):
+        with lock:
+            if key not in bodies:
+                bodies[key] = json.dumps(build())
+            return bodies[key]
+
+    def get_dv(srv, match, query, body):
+        dv_id = match.group(1)
+        if dv_id not in catalogue["DVs"]:
+            return 404, JSON, ""
+        return 200, JSON, cached_body(f"DV:{dv_id}", lambda: catalogue["DVs"][dv_id])
+
+    def get_cl(srv, match, query, body):
+        cl_id = match.group(1)
+        if cl_id not in catalogue["codelists"]:
+            return 404, JSON, ""
+        return 200, JSON, cached_body(f"CL:{cl_id}", lambda: catalogue["codelists"][cl_id]["CL"])
+
+    def get_cle(srv, match, query, body):
+        cl_id = match.group(1)
+        if cl_id not in catalogue["codelists"]:
+            return 404, JSON, ""
+        return 200, JSON, cached_body(f"CLE:{cl_id}", lambda: catalogue["codelists"][cl_id]["CLE"])
+
+    server.add_route("GET", r"/api/DefinedVariables/([^/]+)$", get_dv)
+    server.add_route("GET", r"/api/CodeLists/([^/]+)$", get_cl)
+    server.add_route("GET", r"/api/CodeLists/([^/]+)/codeListEntries$", get_cle)
+
+
+def setup_client(server_url: str, workdir: str, timer: StageTimer):
+    """Points the shared client at the stand-in server and isolates caches and state in workdir."""
+    unlimited = {group: (1e6, 10**6) for group in set(api_client.RATE_LIMIT_GROUPS.values())}
+    api_client._client = api_client.ApiClient(base_override=server_url, rate_limits=unlimited)
+    codelist_cache._cache = codelist_cache.CodeListCache(os.path.join(workdir, "codelists.sqlite"))
+    importer._person_resolver = PersonResolver(importer.get_Person, importer.post_Person, path=None)
+
+    # Stages called inside map_DV are timed by replacing the module globals map_DV looks up
+    for stage, name in (("get_CL", "get_CL"), ("get_CLE", "get_CLE_entries"),
+                        ("sort_codelist_entries", "sort_codelist_entries")):
+        setattr(importer, name, timer.wrap(stage, getattr(importer, name)))
+
+
+def migrate(dv_id: str, timer: StageTimer, environment: str = "DEV"):
+    start = time.perf_counter()
+    DV = timer.wrap("get_DV", importer.get_DV)(dv_id, None)
+    concept_data, CLE_data = timer.wrap("map_DV", importer.map_DV)(DV, None)
+    timer.wrap("ensure_users", importer.ensure_users)(
+        [DV["responsibleDeputy"]["identifier"], DV["responsiblePerson"]["identifier"]], None, environment)
+    concept_id = timer.wrap("post_concept", importer.post_concept)(concept_data, DV, None, environment)
+    if CLE_data is not None:
+        timer.wrap("post_codelist_entries", importer.post_codelist_entries)(concept_id, CLE_data, DV, None, environment)
+    timer.wrap("put_registrationStatus", importer.put_registrationStatus)(concept_id, None, environment)
+    timer.wrap("put_publicationLevel", importer.put_publicationLevel)(concept_id, None, environment)
+    timer.add("total", time.perf_counter() - start)
+
+
+def http_summary() -> Dict[str, Dict[str, float]]:
+    """Requests, retries and bytes per host, from the counters the ApiClient records."""
+    summary: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for row in instrumentation.metrics.snapshot():
+        if row["type"] != "counter" or not row["metric"].startswith("http_"):
+            continue
+        labels = row["labels"]
+        key = {"http_requests_total": "requests", "http_retries_total": "retries"}.get(row["metric"])
+        if row["metric"] == "http_bytes_total":
+            key = f"bytes_{labels['direction']}"
+        summary[labels["host"]][key] += row["value"]
+    return {host: dict(values) for host, values in summary.items()}
+
+
+def migrate_pipeline(dv_ids: List[str], timer: StageTimer, args, environment: str = "DEV") -> List[Dict[str, Any]]:
+    """Migrates all DVs through SMS2_batch_migration.run_pipeline, timing the same stages."""
+    for stage in ("get_DV", "map_DV", "ensure_users", "post_concept", "post_codelist_entries",
+                  "put_registrationStatus", "put_publicationLevel"):
+        setattr(batch, stage, timer.wrap(stage, getattr(batch, stage)))
+    targets = [{"dv_id": dv_id, "identifier": None, "version": None} for dv_id in dv_ids]
+    results = batch.run_pipeline(targets, None, None, environment, workers=batch.parse_workers(args.stage_workers),
+                                 queue_size=args.queue_size)
+    for result in results:
+        if "duration_s" in result:
+            timer.add("total", result["duration_s"])
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> Dict[str, Any]:
+    catalogue = generate_catalogue(args.dvs, args.codelist_sizes, args.depth, args.codelist_share, args.seed)
+    server = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                          seed=args.seed)
+    install_sms2_routes(server, catalogue)
+
+    timer = StageTimer()
+    instrumentation.metrics.reset()
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        setup_client(server.url, workdir, timer)
+        start = time.perf_counter()
+        if args.pipeline:
+            for result in migrate_pipeline(list(catalogue["DVs"]), timer, args):
+                if result["status"] == "failed":
+                    failures.append({"dv_id": result["dv_id"], "error": result["error"]})
+        else:
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                futures = {executor.submit(migrate, dv_id, timer): dv_id for dv_id in catalogue["DVs"]}
+                for future, dv_id in futures.items():
+                    if future.exception() is not None:
+                        failures.append({"dv_id": dv_id, "error": repr(future.exception())})
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+
+    migrated = args.dvs - len(failures)
+    return {
+        "benchmark": "bench_migration",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "dvs": args.dvs,
+        "codelist_entries": sum(len(c["CLE"]) for c in catalogue["codelists"].values()),
+        "migrated": migrated,
+        "failed": len(failures),
+        "failures": failures[:20],
+        "elapsed_s": round(elapsed, 3),
+        "dvs_per_s": round(migrated / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+        "server": server.stats,
+        "http": http_summary(),
+        "stages": timer.summary(),
+    }
+
+
+def print_result(result: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+    print(f"{result['migrated']}/{result['dvs']} DVs in {result['elapsed_s']} s: {result['dvs_per_s']} DVs/s, "
+          f"peak RSS {result['peak_rss_mb']} MB")
+    if previous:
+        print(f"  previous ({previous.get('commit')}): {previous['dvs_per_s']} DVs/s, "
+              f"peak RSS {previous['peak_rss_mb']} MB")
+    print(f"{'stage':<24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'prev p95':>9}")
+    for stage, values in result["stages"].items():
+        previous_p95 = (previous or {}).get("stages", {}).get(stage, {}).get("p95_ms", "")
+        print(f"{stage:<24} {values['count']:>7} {values['p50_ms']:>9} {values['p95_ms']:>9} {values['p99_ms']:>9} "
+              f"{previous_p95:>9}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dvs", type=int, default=100)
+    parser.add_argument("--codelist-sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--depth", type=int, default=1, help="Levels of the code lists (1 = flat)")
+    parser.add_argument("--codelist-share", type=float, default=0.5, help="Share of CodeList DVs")
+    parser.add_argument("--workers", type=int, default=1, help="DVs migrated at the same time")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Use the staged pipeline of SMS2_batch_migration.py instead of --workers DV threads")
+    parser.add_argument("--stage-workers", action="append", default=[],
+                        help="Worker threads of a pipeline stage, e.g. --stage-workers post_concept=8")
+    parser.add_argument("--queue-size", type=int, default=batch.DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Result file (default: results/<timestamp>_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Previous result file to compare with")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    print_result(result, previous)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"bench_migration_{time.strftime('%Y%m%d_%H%M%S')}_{result['commit']}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to '{output}'")
+
+
+if __name__ == "__main__":
+    main()
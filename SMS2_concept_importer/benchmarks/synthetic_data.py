@@ -0,0 +1,91 @@
+"""Synthetic SMS2 defined variables and code lists for the benchmarks."""
+import random
+import uuid
+from typing import Dict, Any, List, Optional
+
+LANGUAGES = ("de", "fr", "it", "en")
+PERSONS = [f"person{i}.bench{i}@bfs.admin.ch" for i in range(20)]
+
+
+def _text(label: str) -> Dict[str, str]:
+    return {language: f"{label} ({language})" for language in LANGUAGES}
+
+
+def generate_entries(size: int, depth: int, seed: int = 0, code_key: str = "code") -> List[Dict[str, Any]]:
+    """Generates `size` codelist entries spread evenly over `depth` levels, in shuffled order.
+
+    depth=1 gives a flat code list. With code_key="value" the entries have the SMS2 shape, with "code" the
+    shape after map_CLE.
+    """
+    rng = random.Random(seed)
+    depth = max(1, min(depth, size)) if size else 1
+    per_level = max(1, size // depth)
+    entries = []
+    previous_level: List[str] = []
+    for level in range(depth):
+        count = per_level if level < depth - 1 else size - per_level * (depth - 1)
+        current_level = []
+        for _ in range(count):
+            code = f"C{len(entries)}"
+            parent = rng.choice(previous_level) if previous_level else None
+            entries.append({code_key: code, "parentCode": parent, "name": _text(code), "description": None})
+            current_level.append(code)
+        previous_level = current_level or previous_level
+    rng.shuffle(entries)
+    return entries
+
+
+def generate_codelist(cl_id: str, size: int, depth: int, seed: int = 0) -> Dict[str, Any]:
+    """Returns the SMS2 code list metadata and entries of a synthetic code list."""
+    return {
+        "CL": {"id": cl_id, "version": "1.0.0", "codeListEntryValueType": "String",
+               "codeListEntryValueMaxLength": 20},
+        "CLE": generate_entries(size, depth, seed, code_key="value"),
+    }
+
+
+def generate_dv(index: int, dv_type: str, codelist_id: Optional[str] = None,
+                rng: Optional[random.Random] = None) -> Dict[str, Any]:
+    """Returns an SMS2 defined variable of the given type."""
+    rng = rng or random.Random(index)
+    DV = {
+        "id": str(uuid.UUID(int=index + 1)),
+        "identifier": f"BENCH_DV_{index}",
+        "version": "1.0.0",
+        "agencyId": "6e7f0c77-97de-44db-a32c-87bc73fa21c3",
+        "definedVariableType": dv_type,
+        "conformsTo": [],
+        "description": _text(f"Description {index}"),
+        "name": _text(f"Variable {index}"),
+        "responsibleDeputy": {"identifier": rng.choice(PERSONS)},
+        "responsiblePerson": {"identifier": rng.choice(PERSONS)},
+        "validFrom": "2024-01-01T00:00:00+00:00",
+        "validTo": None,
+    }
+    if dv_type == "CodeList":
+        DV["codeListId"] = codelist_id
+    elif dv_type == "Numeric":
+        DV.update(maxValue=1000, minValue=0, measurementUnit="CHF", numberDecimals=2)
+    elif dv_type == "String":
+        DV.update(maxLength=50, minLength=1, pattern=None)
+    elif dv_type == "Date":
+        DV.update(pattern="yyyy-MM-dd")
+    return DV
+
+
+def generate_catalogue(count: int, codelist_sizes: List[int], depth: int, codelist_share: float = 0.5,
+                       seed: int = 0) -> Dict[str, Any]:
+    """Generates `count` DVs; `codelist_share` of them are CodeList DVs, cycling through `codelist_sizes`."""
+    rng = random.Random(seed)
+    DVs = {}
+    codelists = {}
+    for index in range(count):
+        if rng.random() < codelist_share:
+            size = codelist_sizes[len(codelists) % len(codelist_sizes)]
+            cl_id = str(uuid.UUID(int=10**9 + index))
+            codelists[cl_id] = generate_codelist(cl_id, size, depth, seed=index)
+            DV = generate_dv(index, "CodeList", cl_id, rng)
+        else:
+            DV = generate_dv(index, rng.choice(["Numeric", "String", "Date"]), rng=rng)
+        DVs[DV["id"]] = DV
+    return {"DVs": DVs, "codelists": codelists}
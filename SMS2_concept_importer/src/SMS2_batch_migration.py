@@ -0,0 +1,750 @@
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from typing import Optional, Dict, Any, List, Iterable, Tuple, Callable
+
+from api_client import get_client
+from codelist_cache import get_cache
+from environments import ENVIRONMENTS, get_environment
+from instrumentation import configure_logging, export_metrics, logger, metrics, span
+from migration_journal import MigrationJournal, DEFAULT_JOURNAL_PATH, STARTED
+from pipeline import Pipeline, Stage, DEFAULT_QUEUE_SIZE
+from sync_state import SyncState, DEFAULT_STATE_PATH
+from SMS2_check_new_versions import iter_sms2_catalogue, filter_agency
+from SMS2_concept_importer import (
+    get_DV,
+    map_DV,
+    ensure_users,
+    get_person_resolver,
+    find_concept,
+    post_concept,
+    post_codelist_entries,
+    put_registrationStatus,
+    put_publicationLevel,
+    SMS2_token,
+)
+
+OUTPUT_DIR = "SMS2_concept_importer/output"
+
+# Worker threads per pipeline stage (--workers <stage>=<n>). Map is CPU-bound, ensure_users is serialized
+# by the person resolver anyway, the HTTP stages are bounded by the per-host limits of the ApiClient.
+PIPELINE_WORKERS = {
+    "fetch": 8,
+    "map": 2,
+    "ensure_users": 1,
+    "post_concept": 4,
+    "upload_codelist": 2,
+    "set_status": 4,
+}
+
+# SMS2 DV ids are GUIDs, everything else in an input file is treated as a DV identifier (e.g. AREA_NOAS)
+DV_ID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def load_diff_file(path: str) -> Dict[str, List[str]]:
+    """Reads only_in_sms2.json or version_mismatches.json and returns the SMS2 versions to migrate per identifier."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    result = {}
+    for identifier, versions in data.items():
+        # version_mismatches.json: only migrate the versions that are not yet in I14Y
+        if isinstance(versions, dict):
+            i14y_versions = set(versions.get("i14y_versions", []))
+            versions = [v for v in versions.get("sms2_versions", []) if v not in i14y_versions]
+        if versions:
+            result.setdefault(identifier, []).extend(versions)
+    return result
+
+
+# Plan entries with content drift already exist in I14Y and need an update, not a new concept
+MIGRATABLE_REASONS = {"new_concept", "new_version", "missing_version"}
+
+
+def load_plan_file(path: str) -> List[Dict[str, Any]]:
+    """Reads the migration_plan.json written by SMS2_check_new_versions.py (DV ids included, no lookup needed)."""
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+
+    drifted = [m for m in plan.get("migrate", []) if m["reason"] not in MIGRATABLE_REASONS]
+    if drifted:
+        logger.warning("%d concepts in %s have content drift and are not migrated again: %s", len(drifted), path,
+                       ", ".join(f"{m['identifier']}@{m['version']}" for m in drifted[:20]))
+    return [
+        {"dv_id": m["dv_id"], "identifier": m["identifier"], "version": m["version"]}
+        for m in plan.get("migrate", []) if m["reason"] in MIGRATABLE_REASONS
+    ]
+
+
+def load_id_file(path: str) -> List[str]:
+    """Reads a plain text file with one DV id per line (empty lines and # comments are ignored)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def resolve_dv_ids(identifier_versions: Dict[str, List[str]], token) -> List[Dict[str, Any]]:
+    """Looks up the SMS2 DV id for every (identifier, version) pair of the BFS catalogue."""
+    if not identifier_versions:
+        return []
+
+    lookup = {
+        (item.get("identifier"), item.get("version")): item.get("id")
+        for item in filter_agency(iter_sms2_catalogue(token))
+    }
+
+    targets = []
+    for identifier, versions in identifier_versions.items():
+        for version in versions:
+            targets.append({
+                "dv_id": lookup.get((identifier, version)),
+                "identifier": identifier,
+                "version": version,
+            })
+    return targets
+
+
+def collect_targets(dv_ids: Iterable[str], diff_files: Iterable[str], id_files: Iterable[str], token,
+                    plan_files: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """Builds the de-duplicated list of DVs to migrate from all inputs."""
+    targets = []
+    for path in plan_files:
+        targets.extend(load_plan_file(path))
+    identifier_versions = {}
+
+    plain_ids = list(dv_ids)
+    for path in id_files:
+        plain_ids.extend(load_id_file(path))
+
+    for value in plain_ids:
+        if DV_ID_PATTERN.match(value):
+            targets.append({"dv_id": value, "identifier": None, "version": None})
+        else:
+            # Identifiers are shared by all versions of a DV, so the version is required
+            identifier, _, version = value.partition("@")
+            if not version:
+                raise ValueError(f"'{value}' is not a DV id. Use <identifier>@<version> to migrate by identifier.")
+            identifier_versions.setdefault(identifier, []).append(version)
+
+    for path in diff_files:
+        for identifier, versions in load_diff_file(path).items():
+            identifier_versions.setdefault(identifier, []).extend(versions)
+
+    targets.extend(resolve_dv_ids(identifier_versions, token))
+
+    seen = set()
+    unique_targets = []
+    for target in targets:
+        key = target["dv_id"] or (target["identifier"], target["version"])
+        if key not in seen:
+            seen.add(key)
+            unique_targets.append(target)
+    return unique_targets
+
+
+def collect_incremental_targets(state: SyncState, environment: str, catalogue: Iterable[Dict[str, Any]]
+                                ) -> List[Dict[str, Any]]:
+    """Returns the DVs of the catalogue (the BFS DVs of the SMS2 listing) that have not been migrated to the
+    environment yet."""
+    return [
+        {"dv_id": item.get("id"), "identifier": item.get("identifier"), "version": item.get("version")}
+        for item in state.pending(environment, catalogue)
+    ]
+
+
+def prefetch_DVs(dv_ids: List[str], SMS2_token) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Fetches the DVs of the batch concurrently."""
+    futures = {dv_id: get_client().submit(get_DV, dv_id, SMS2_token) for dv_id in dict.fromkeys(dv_ids)}
+    return {dv_id: future.result() for dv_id, future in futures.items()}
+
+
+def provision_users(DVs: Iterable[Dict[str, Any]], I14Y_token, I14Y_environment="DEV"):
+    """Creates all responsible persons of the batch that are missing in I14Y in one bulk request."""
+    emails = []
+    for DV in DVs:
+        emails.append(DV.get("responsibleDeputy", {}).get("identifier"))
+        emails.append(DV.get("responsiblePerson", {}).get("identifier"))
+    try:
+        ensure_users(emails, I14Y_token, I14Y_environment)
+    except Exception as e:
+        # Not fatal: every DV checks its persons again (from the cache) before it is posted
+        logger.warning("Bulk user provisioning failed, users are checked per DV: %s: %s", type(e).__name__, e)
+
+
+def already_migrated(dv_id: str, I14Y_environment: str, state: Optional[SyncState],
+                     journal: Optional[MigrationJournal]) -> Optional[Dict[str, Any]]:
+    """Returns the state record of a DV whose migration finished, None if (part of) it has to run.
+
+    DVs recorded before the journal existed have no journaled steps and count as finished.
+    """
+    synced = state.get_by_dv_id(I14Y_environment, dv_id) if state else None
+    if synced is None or journal is None:
+        return synced
+    if journal.steps(I14Y_environment, dv_id) and not journal.is_complete(I14Y_environment, dv_id):
+        return None
+    return synced
+
+
+def journaled_step(journal: Optional[MigrationJournal], I14Y_environment: str, dv_id: str, step: str,
+                   concept_id: str, fn: Callable[[], Any]):
+    """Runs fn unless the journal has the step as done; marks it started before and done after."""
+    if journal is not None:
+        if journal.is_done(I14Y_environment, dv_id, step):
+            return
+        journal.begin(I14Y_environment, dv_id, step, concept_id)
+    fn()
+    if journal is not None:
+        journal.done(I14Y_environment, dv_id, step, concept_id)
+
+
+def post_concept_once(DV: Dict[str, Any], dv_id: str, concept_data, I14Y_token, I14Y_environment: str,
+                      journal: Optional[MigrationJournal]) -> Tuple[str, bool]:
+    """Posts the concept unless it was posted before, and returns (concept_id, adopted).
+
+    The concept id comes from the journal if the post is done; otherwise I14Y is asked for a concept with
+    the same identifier and version first, which covers a crash between the post and its journal entry.
+    `adopted` is True for a concept that exists in I14Y without this journal having posted it. This includes
+    --force runs, whose journal entries are dropped: an existing concept is never posted a second time.
+    """
+    post = journal.steps(I14Y_environment, dv_id).get("post_concept", {}) if journal else {}
+    if post.get("status") == "done":
+        # A resumed DV keeps treating an adopted concept as adopted
+        return post["concept_id"], bool((post.get("detail") or {}).get("adopted"))
+
+    existing = find_concept(DV["identifier"], DV["version"], I14Y_token, I14Y_environment)
+    if existing:
+        adopted = post.get("status") != STARTED
+        if adopted:
+            logger.warning("%s %s already exists in I14Y as %s and is not posted again",
+                           DV["identifier"], DV["version"], existing,
+                           extra={"dv_id": dv_id, "concept_id": existing})
+        if journal:
+            journal.done(I14Y_environment, dv_id, "post_concept", existing,
+                         {"found_existing": True, "adopted": adopted})
+        return existing, adopted
+
+    if journal:
+        journal.begin(I14Y_environment, dv_id, "post_concept")
+    concept_id = post_concept(concept_data, DV, I14Y_token, I14Y_environment)
+    if journal:
+        journal.done(I14Y_environment, dv_id, "post_concept", concept_id)
+    return concept_id, False
+
+
+def upload_codelist_once(concept_id: str, adopted: bool, CLE_data, DV: Dict[str, Any], dv_id: str, I14Y_token,
+                         I14Y_environment: str, journal: Optional[MigrationJournal]):
+    """Uploads the codelist entries unless the journal has them as done.
+
+    A chunked upload that was interrupted resumes after its last acknowledged chunk, because the journal
+    hands the same concept id to post_codelist_entries again. The entries of an adopted concept are left
+    alone, importing them a second time could duplicate them.
+    """
+    def upload():
+        if CLE_data is None:
+            return
+        if adopted:
+            logger.warning("Codelist entries of the existing concept %s are not uploaded again", concept_id,
+                           extra={"dv_id": dv_id, "concept_id": concept_id})
+            return
+        post_codelist_entries(concept_id, CLE_data, DV, I14Y_token, I14Y_environment)
+    journaled_step(journal, I14Y_environment, dv_id, "upload_codelist", concept_id, upload)
+
+
+def set_status_once(concept_id: str, adopted: bool, dv_id: str, I14Y_token, I14Y_environment: str,
+                    journal: Optional[MigrationJournal]):
+    """Sets registration status and publication level; a rejected call fails the DV, so it is resumed.
+
+    The status of an adopted concept is left alone: it may have been promoted (e.g. to Standard or
+    Internal) since it was posted, and resetting it to Recorded/Public would undo that.
+    """
+    def call(put):
+        if adopted:
+            # Journaled as done all the same, so the DV counts as complete
+            return lambda: None
+        return lambda: put(concept_id, I14Y_token, environment=I14Y_environment).raise_for_status()
+
+    if adopted:
+        logger.warning("Registration status and publication level of the existing concept %s are left unchanged",
+                       concept_id, extra={"dv_id": dv_id, "concept_id": concept_id})
+
+    # Registration status first: the publication level is only set on a registered concept
+    journaled_step(journal, I14Y_environment, dv_id, "registration_status", concept_id,
+                   call(put_registrationStatus))
+    journaled_step(journal, I14Y_environment, dv_id, "publication_level", concept_id,
+                   call(put_publicationLevel))
+
+
+def migrate_one(target: Dict[str, Any], SMS2_token, I14Y_token, I14Y_environment="DEV",
+                state: Optional[SyncState] = None, force: bool = False,
+                DV: Optional[Dict[str, Any]] = None, journal: Optional[MigrationJournal] = None) -> Dict[str, Any]:
+    """Runs the full migration for a single DV and never raises: failures are returned in the result.
+
+    With a state store, DVs that were already migrated are skipped and every posted concept is recorded
+    before the status calls. With a journal, a DV interrupted by a crash continues with the first step
+    that did not finish, and its concept is never posted twice.
+    """
+    result = dict(target, status="failed", concept_id=None, error=None)
+    start = time.perf_counter()
+    try:
+        if not target["dv_id"]:
+            raise ValueError(f"No SMS2 DV found for {target['identifier']} version {target['version']}")
+
+        synced = already_migrated(target["dv_id"], I14Y_environment, state, journal) if not force else None
+        if synced:
+            result.update(status="skipped", concept_id=synced["concept_id"],
+                          identifier=synced["identifier"], version=synced["version"])
+            return result
+        if force and journal:
+            journal.forget(I14Y_environment, target["dv_id"])
+
+        DV = DV or get_DV(target["dv_id"], SMS2_token)
+        if DV is None:
+            raise ValueError(f"Failed to fetch Defined Variable (DV) with ID: {target['dv_id']}")
+        result["identifier"] = DV["identifier"]
+        result["version"] = DV["version"]
+
+        concept_data, CLE_data = map_DV(DV, SMS2_token)
+
+        ensure_users([DV["responsibleDeputy"]["identifier"], DV["responsiblePerson"]["identifier"]],
+                     I14Y_token, I14Y_environment)
+
+        concept_id, adopted = post_concept_once(DV, target["dv_id"], concept_data, I14Y_token, I14Y_environment,
+                                                journal)
+        result["concept_id"] = concept_id
+        if state:
+            state.record(I14Y_environment, DV["identifier"], DV["version"], target["dv_id"], concept_id)
+
+        upload_codelist_once(concept_id, adopted, CLE_data, DV, target["dv_id"], I14Y_token, I14Y_environment,
+                             journal)
+        set_status_once(concept_id, adopted, target["dv_id"], I14Y_token, I14Y_environment, journal)
+        result["status"] = "migrated"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    finally:
+        result["duration_s"] = round(time.perf_counter() - start, 3)
+        metrics.inc("dvs_total", status=result["status"])
+        metrics.observe("stage_seconds", time.perf_counter() - start, stage="migrate_one")
+    return result
+
+
+def run_batch(targets: List[Dict[str, Any]], SMS2_token, I14Y_token, I14Y_environment="DEV",
+              state: Optional[SyncState] = None, force: bool = False,
+              journal: Optional[MigrationJournal] = None) -> List[Dict[str, Any]]:
+    """Migrates all targets one after another and keeps going when a DV fails.
+
+    All DVs are fetched first, so the persons of the whole batch can be created before any concept is posted.
+    """
+    to_fetch = [
+        t["dv_id"] for t in targets
+        if t["dv_id"] and (force or not already_migrated(t["dv_id"], I14Y_environment, state, journal))
+    ]
+    with span("prefetch_DVs", count=len(to_fetch)):
+        DVs = prefetch_DVs(to_fetch, SMS2_token)
+    with span("provision_users"):
+        provision_users([DV for DV in DVs.values() if DV], I14Y_token, I14Y_environment)
+
+    results = []
+    for i, target in enumerate(targets, start=1):
+        label = target["dv_id"] or f"{target['identifier']}@{target['version']}"
+        logger.debug("[%d/%d] Migrating %s", i, len(targets), label)
+        result = migrate_one(target, SMS2_token, I14Y_token, I14Y_environment, state=state, force=force,
+                             DV=DVs.get(target["dv_id"]), journal=journal)
+        fields = {"dv_id": target["dv_id"], "status": result["status"], "concept_id": result["concept_id"],
+                  "duration_s": result["duration_s"]}
+        if result["status"] == "migrated":
+            logger.info("[%d/%d] OK %s -> %s", i, len(targets), label, result["concept_id"], extra=fields)
+        elif result["status"] == "skipped":
+            logger.info("[%d/%d] SKIPPED %s, already migrated as %s", i, len(targets), label, result["concept_id"],
+                        extra=fields)
+        else:
+            logger.error("[%d/%d] FAILED %s: %s", i, len(targets), label, result["error"],
+                         extra=dict(fields, error=result["error"]))
+        results.append(result)
+    return results
+
+
+class MigrationJob:
+    """A DV on its way through the pipeline: fetched and mapped once, shared by all target environments."""
+
+    def __init__(self, target: Dict[str, Any], environments: Iterable[str]):
+        self.target = target
+        self.DV = None
+        self.concept_data = None
+        self.CLE_data = None
+        self.started = None
+        self.environments = {environment: EnvironmentJob(self, environment) for environment in environments}
+        self.pending = len(self.environments)
+
+
+class EnvironmentJob:
+    """The migration of one DV to one environment; `result` is its entry in the report of that environment."""
+
+    def __init__(self, job: MigrationJob, environment: str):
+        self.job = job
+        self.environment = environment
+        self.result = dict(job.target, status="failed", concept_id=None, error=None)
+        self.adopted = False
+        self.finished = False
+
+    @property
+    def label(self) -> str:
+        return self.result["dv_id"] or f"{self.result['identifier']}@{self.result['version']}"
+
+
+def run_fanout(targets: List[Dict[str, Any]], SMS2_token, I14Y_tokens: Dict[str, Any],
+               state: Optional[SyncState] = None, force: bool = False,
+               workers: Optional[Dict[str, int]] = None, queue_size: int = DEFAULT_QUEUE_SIZE,
+               dead_letter_path: Optional[str] = None,
+               journal: Optional[MigrationJournal] = None,
+               environment_targets: Optional[Dict[str, List[Dict[str, Any]]]] = None
+               ) -> Dict[str, List[Dict[str, Any]]]:
+    """Migrates all targets to every environment of I14Y_tokens ({environment: token}) and returns the
+    results per environment. environment_targets ({environment: targets}) are only migrated to their own
+    environment, e.g. migrations resumed where they were interrupted.
+
+    The DVs are fetched first and the responsible persons of the batch provisioned once per environment.
+    Each DV is then mapped once; the payloads are handed to one pipeline per environment
+    (ensure users, post concept, upload code list, set status), which run concurrently. Every stage has
+    its own workers, and every environment its own hosts, connection pools and rate limit (see
+    environments.py) as well as its own journal entries, so a slow or failing environment does not hold
+    back the others. Failed DVs are written to dead_letter_path with the environment and stage.
+    """
+    workers = dict(PIPELINE_WORKERS, **(workers or {}))
+    environments = list(I14Y_tokens)
+    jobs = [MigrationJob(target, environments) for target in targets]
+    # A DV needed by several environments is still fetched and mapped once
+    own_environments: Dict[Any, Tuple[Dict[str, Any], List[str]]] = {}
+    for environment, own_targets in (environment_targets or {}).items():
+        for target in own_targets:
+            key = target["dv_id"] or id(target)
+            own_environments.setdefault(key, (target, []))[1].append(environment)
+    jobs.extend(MigrationJob(target, own) for target, own in own_environments.values())
+    totals = {environment: sum(1 for job in jobs if environment in job.environments) for environment in environments}
+    done = {environment: 0 for environment in environments}
+    done_lock = threading.Lock()
+
+    def finished(env_job: EnvironmentJob):
+        job = env_job.job
+        with done_lock:
+            if env_job.finished:
+                return
+            env_job.finished = True
+            done[env_job.environment] += 1
+            position = done[env_job.environment]
+            job.pending -= 1
+            if job.pending == 0:
+                # Every environment is done with the payloads
+                job.DV = job.concept_data = job.CLE_data = None
+        result = env_job.result
+        if job.started is not None:
+            result["duration_s"] = round(time.perf_counter() - job.started, 3)
+        metrics.inc("dvs_total", status=result["status"], environment=env_job.environment)
+        total = totals[env_job.environment]
+        prefix = f"[{env_job.environment} {position}/{total}]" if len(environments) > 1 else f"[{position}/{total}]"
+        fields = {"dv_id": result["dv_id"], "environment": env_job.environment, "status": result["status"],
+                  "concept_id": result["concept_id"], "duration_s": result.get("duration_s")}
+        if result["status"] == "migrated":
+            logger.info("%s OK %s -> %s", prefix, env_job.label, result["concept_id"], extra=fields)
+        elif result["status"] == "skipped":
+            logger.info("%s SKIPPED %s, already migrated as %s", prefix, env_job.label, result["concept_id"],
+                        extra=fields)
+        else:
+            logger.error("%s FAILED %s in %s: %s", prefix, env_job.label, result["stage"], result["error"],
+                         extra=dict(fields, error=result["error"]))
+
+    def failed(env_job: EnvironmentJob, stage: str, error: BaseException, trace: str):
+        env_job.result.update(status="failed", stage=stage, error=f"{type(error).__name__}: {error}",
+                              traceback=trace)
+        finished(env_job)
+
+    # Fetch and map, once per DV
+
+    def fetch(job: MigrationJob):
+        job.started = time.perf_counter()
+        dv_id = job.target["dv_id"]
+        if not dv_id:
+            raise ValueError(f"No SMS2 DV found for {job.target['identifier']} version {job.target['version']}")
+        for environment, env_job in job.environments.items():
+            synced = already_migrated(dv_id, environment, state, journal) if not force else None
+            if synced:
+                env_job.result.update(status="skipped", concept_id=synced["concept_id"],
+                                      identifier=synced["identifier"], version=synced["version"])
+                finished(env_job)
+            elif force and journal:
+                journal.forget(environment, dv_id)
+        if all(env_job.finished for env_job in job.environments.values()):
+            return None
+        job.DV = DVs.pop(dv_id, None)
+        if job.DV is None:
+            raise ValueError(f"Failed to fetch Defined Variable (DV) with ID: {dv_id}")
+        for env_job in job.environments.values():
+            env_job.result["identifier"] = job.DV["identifier"]
+            env_job.result["version"] = job.DV["version"]
+        return job
+
+    def map_(job: MigrationJob):
+        job.concept_data, job.CLE_data = map_DV(job.DV, SMS2_token)
+        return job
+
+    def dispatch(job: MigrationJob):
+        # Blocks while an environment pipeline is full, which holds back fetch and map as well
+        for environment, env_job in job.environments.items():
+            if not env_job.finished:
+                feeds[environment].put(env_job)
+        return None
+
+    def prepare_failed(job: MigrationJob, stage: str, error: BaseException, trace: str):
+        for env_job in job.environments.values():
+            if not env_job.finished:
+                failed(env_job, stage, error, trace)
+
+    # Post, once per DV and environment
+
+    def environment_stages(environment: str, I14Y_token) -> List[Stage]:
+        # Cache hits after provision_users; only a DV whose persons could not be provisioned sends requests
+        def users(env_job: EnvironmentJob):
+            DV = env_job.job.DV
+            ensure_users([DV["responsibleDeputy"]["identifier"], DV["responsiblePerson"]["identifier"]],
+                         I14Y_token, environment)
+            return env_job
+
+        def post(env_job: EnvironmentJob):
+            job = env_job.job
+            concept_id, env_job.adopted = post_concept_once(job.DV, job.target["dv_id"], job.concept_data,
+                                                            I14Y_token, environment, journal)
+            env_job.result["concept_id"] = concept_id
+            if state:
+                state.record(environment, job.DV["identifier"], job.DV["version"], job.target["dv_id"], concept_id)
+            return env_job
+
+        def upload(env_job: EnvironmentJob):
+            job = env_job.job
+            upload_codelist_once(env_job.result["concept_id"], env_job.adopted, job.CLE_data, job.DV,
+                                 job.target["dv_id"], I14Y_token, environment, journal)
+            return env_job
+
+        def set_status(env_job: EnvironmentJob):
+            set_status_once(env_job.result["concept_id"], env_job.adopted, env_job.job.target["dv_id"], I14Y_token,
+                            environment, journal)
+            env_job.result["status"] = "migrated"
+            return env_job
+
+        return [
+            Stage("ensure_users", users, workers["ensure_users"]),
+            Stage("post_concept", post, workers["post_concept"]),
+            Stage("upload_codelist", upload, workers["upload_codelist"]),
+            Stage("set_status", set_status, workers["set_status"]),
+        ]
+
+    # Like run_batch, the DVs (not their code lists) are fetched up front, so the persons of the whole batch
+    # are checked once and the missing ones created in one request per environment
+    pending = {environment: [] for environment in environments}
+    for job in jobs:
+        dv_id = job.target["dv_id"]
+        for environment in job.environments:
+            if dv_id and (force or not already_migrated(dv_id, environment, state, journal)):
+                pending[environment].append(dv_id)
+    to_fetch = list(dict.fromkeys(dv_id for dv_ids in pending.values() for dv_id in dv_ids))
+    with span("prefetch_DVs", count=len(to_fetch)):
+        DVs = prefetch_DVs(to_fetch, SMS2_token)
+    for environment, token in I14Y_tokens.items():
+        with span("provision_users", environment=environment):
+            provision_users([DVs[dv_id] for dv_id in pending[environment] if DVs.get(dv_id)], token, environment)
+
+    feeds = {environment: queue.Queue(maxsize=queue_size) for environment in environments}
+    environment_pipelines = {
+        environment: Pipeline(environment_stages(environment, token), queue_size=queue_size, name=environment,
+                              on_complete=finished, on_failure=failed)
+        for environment, token in I14Y_tokens.items()
+    }
+    threads = [
+        threading.Thread(target=pipeline.run, args=(iter(feeds[environment].get, None),),
+                         name=f"pipeline-{environment}", daemon=True)
+        for environment, pipeline in environment_pipelines.items()
+    ]
+    for thread in threads:
+        thread.start()
+
+    prepare = Pipeline([
+        Stage("fetch", fetch, workers["fetch"]),
+        Stage("map", map_, workers["map"]),
+        Stage("dispatch", dispatch, 1),
+    ], queue_size=queue_size, on_failure=prepare_failed)
+    prepare.run(jobs)
+    for feed in feeds.values():
+        feed.put(None)
+    for thread in threads:
+        thread.join()
+
+    stats = {"prepare": prepare.stats(), **{env: p.stats() for env, p in environment_pipelines.items()}}
+    logger.debug("Pipeline stages: %s", stats, extra={"pipeline": stats})
+
+    results = {environment: [job.environments[environment].result for job in jobs if environment in job.environments]
+               for environment in environments}
+    dead_letters = [
+        dict({key: result[key] for key in ("dv_id", "identifier", "version", "concept_id")},
+             environment=environment, stage=result.get("stage"), error=result["error"])
+        for environment, environment_results in results.items()
+        for result in environment_results if result["status"] == "failed"
+    ]
+    if dead_letter_path and dead_letters:
+        with open(dead_letter_path, "w", encoding="utf-8") as f:
+            json.dump(dead_letters, f, indent=2)
+        logger.warning("%d migrations failed, dead letters saved to '%s'", len(dead_letters), dead_letter_path)
+    return results
+
+
+def run_pipeline(targets: List[Dict[str, Any]], SMS2_token, I14Y_token, I14Y_environment="DEV",
+                 state: Optional[SyncState] = None, force: bool = False,
+                 workers: Optional[Dict[str, int]] = None, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 dead_letter_path: Optional[str] = None,
+                 journal: Optional[MigrationJournal] = None) -> List[Dict[str, Any]]:
+    """Migrates all targets to one environment through the staged pipeline of run_fanout (fetch, map,
+    ensure users, post concept, upload code list, set status).
+
+    Produces the same results as run_batch. A failing DV does not hold up the others.
+    With a journal, the I14Y steps are journaled and resumed like in migrate_one.
+    """
+    return run_fanout(targets, SMS2_token, {I14Y_environment: I14Y_token}, state=state, force=force,
+                      workers=workers, queue_size=queue_size, dead_letter_path=dead_letter_path,
+                      journal=journal)[I14Y_environment]
+
+
+def parse_workers(values: Iterable[str]) -> Dict[str, int]:
+    """Parses --workers <stage>=<n> options."""
+    workers = {}
+    for value in values:
+        stage, _, count = value.partition("=")
+        if stage not in PIPELINE_WORKERS or not count.isdigit() or int(count) < 1:
+            raise ValueError(f"Invalid --workers '{value}', expected <stage>=<n> with a stage out of "
+                             f"{', '.join(PIPELINE_WORKERS)}")
+        workers[stage] = int(count)
+    return workers
+
+
+def write_report(results: List[Dict[str, Any]], path: str) -> Dict[str, Any]:
+    """Writes the per-DV results and a summary to a JSON report."""
+    summary = {
+        "total": len(results),
+        "migrated": sum(1 for r in results if r["status"] == "migrated"),
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "codelist_cache": get_cache().stats(),
+        "persons": get_person_resolver().stats(),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "results": results}, f, indent=2)
+    return summary
+
+
+def environment_path(path: str, environment: str, environments: List[str]) -> str:
+    """path with the environment appended to the file name when migrating to several environments."""
+    if len(environments) == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{environment}{ext}"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Migrate a batch of SMS2 defined variables to I14Y.")
+    parser.add_argument("dv_ids", nargs="*", help="DV ids (GUID) or <identifier>@<version>")
+    parser.add_argument("--diff", action="append", default=[],
+                        help="Output of SMS2_check_new_versions.py (only_in_sms2.json or version_mismatches.json)")
+    parser.add_argument("--ids-file", action="append", default=[], help="Text file with one DV id per line")
+    parser.add_argument("--plan", action="append", default=[],
+                        help="migration_plan.json written by SMS2_check_new_versions.py")
+    parser.add_argument("--environment", nargs="+", default=["DEV"], choices=list(ENVIRONMENTS),
+                        help="One or more I14Y environments, e.g. --environment DEV ABN PROD. Each DV is fetched "
+                             "and mapped once and posted to all of them concurrently")
+    parser.add_argument("--report", default=os.path.join(OUTPUT_DIR, "batch_report.json"),
+                        help="With several environments, one report per environment (batch_report_<ENV>.json)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Migrate every BFS DV of the SMS2 catalogue that is not in the state store yet")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH, help="SQLite state store of migrated DVs")
+    parser.add_argument("--force", action="store_true",
+                        help="Migrate DVs again even if already in the state store. A concept that still exists "
+                             "in I14Y is reused, not posted twice; its code list and status are left unchanged")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH,
+                        help="SQLite journal of the I14Y steps of every DV, used to resume interrupted migrations")
+    parser.add_argument("--resume", action="store_true",
+                        help="Add every DV whose migration was interrupted (implied by --incremental)")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Migrate one DV after another instead of through the staged pipeline")
+    parser.add_argument("--workers", action="append", default=[],
+                        help="Worker threads of a pipeline stage, e.g. --workers post_concept=8 "
+                             f"(stages: {', '.join(PIPELINE_WORKERS)}; the I14Y stages per environment)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="DVs waiting in front of each pipeline stage before the previous stage blocks")
+    parser.add_argument("--dead-letters", default=os.path.join(OUTPUT_DIR, "dead_letters.json"),
+                        help="Where the failed DVs of a pipeline run are written")
+    parser.add_argument("--log-level", default=os.environ.get("SMS2_log_level", "INFO"),
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--log-json", default=None, help="Also write every log record (DEBUG included) as JSON lines")
+    parser.add_argument("--metrics-jsonl", default=None, help="Append the run's metrics as JSON lines to this file")
+    parser.add_argument("--metrics-prom", default=None, help="Write the run's metrics as Prometheus textfile")
+    args = parser.parse_args(argv)
+    try:
+        workers = parse_workers(args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    environments = list(dict.fromkeys(args.environment))
+    if args.sequential and len(environments) > 1:
+        parser.error("--sequential migrates to one environment only")
+    tokens = {environment: get_environment(environment).token() for environment in environments}
+
+    configure_logging(args.log_level, args.log_json)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    state = SyncState(args.state)
+    journal = MigrationJournal(args.journal)
+
+    targets = collect_targets(args.dv_ids, args.diff, args.ids_file, SMS2_token, args.plan)
+    known = {t["dv_id"] for t in targets}
+    # Interrupted and not yet migrated DVs are migrated only to the environment that needs them
+    environment_targets: Dict[str, List[Dict[str, Any]]] = {environment: [] for environment in environments}
+    catalogue = list(filter_agency(iter_sms2_catalogue(SMS2_token))) if args.incremental else []
+    for environment in environments:
+        own = environment_targets[environment]
+        if args.resume or args.incremental:
+            interrupted = [dv_id for dv_id in journal.incomplete(environment) if dv_id not in known]
+            if interrupted:
+                logger.info("Resuming %d interrupted migrations to %s", len(interrupted), environment)
+            own.extend({"dv_id": dv_id, "identifier": None, "version": None} for dv_id in interrupted)
+        if args.incremental:
+            own_known = known | {t["dv_id"] for t in own}
+            own.extend(t for t in collect_incremental_targets(state, environment, catalogue)
+                       if t["dv_id"] not in own_known)
+        logger.info("%d defined variables to migrate to %s", len(targets) + len(own), environment)
+
+    if args.sequential:
+        environment = environments[0]
+        results = {environment: run_batch(targets + environment_targets[environment], SMS2_token,
+                                          tokens[environment], I14Y_environment=environment, state=state,
+                                          force=args.force, journal=journal)}
+    else:
+        results = run_fanout(targets, SMS2_token, tokens, state=state, force=args.force, workers=workers,
+                             queue_size=args.queue_size, dead_letter_path=args.dead_letters, journal=journal,
+                             environment_targets=environment_targets)
+
+    export_metrics(args.metrics_jsonl, args.metrics_prom)
+
+    failed = 0
+    for environment in environments:
+        report = environment_path(args.report, environment, environments)
+        summary = write_report(results[environment], report)
+        failed += summary["failed"]
+        logger.info("%s: migrated %d/%d defined variables, %d already migrated, %d failed. Report saved to '%s'",
+                    environment, summary["migrated"], summary["total"], summary["skipped"], summary["failed"],
+                    report)
+    cache = summary["codelist_cache"]
+    logger.info("Code list cache: %d hits (%d revalidated), %d misses",
+                cache["hits"], cache["revalidated"], cache["misses"])
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
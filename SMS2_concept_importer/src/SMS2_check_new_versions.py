@@ -1,85 +1,183 @@
+import argparse
+import gzip
 import json
-import requests
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-from typing import Optional, Dict, Any, List
+import time
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Callable
+
+from api_client import get_client, iter_pages
+from environments import ENVIRONMENTS
+from diff_engine import (build_index, sms2_fingerprint, i14y_fingerprint, migration_plan, versions_by_identifier,
+                         DRIFT_FIELDS)
+from instrumentation import configure_logging, logger, span
+from snapshot import write_snapshot, load_index, SnapshotError
 
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
-def _api_get_request(url: str, token) -> Optional[Dict[str, Any]]:
-    """Make a GET request to the API and return JSON response."""
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': token
-    }
-    response = requests.get(url, headers=headers, verify=False)
-    if response.status_code == 200:
-        return json.loads(response.content)
-    return None
-
-def extract_identifiers_and_versions(data: Any, key: Optional[str] = None) -> Dict[str, List[str]]:
-    """Extract identifier and version from a list of objects."""
-    result = {}
-    items = data.get(key, []) if isinstance(data, dict) and key else data
-    for item in items:
-        identifier = item.get("identifier")
-        version = item.get("version")
-        if identifier and version:
-            result.setdefault(identifier, []).append(version)
-    return result
-
-# Variables
-SMS2_token = os.environ.get("SMS2_token")
-I14Y_token = os.environ.get("I14Y_token")
+OUTPUT_DIR = "SMS2_concept_importer/output"
+# Every run saves its catalogues as <run stamp>_<catalogue>.snap, the last SNAPSHOTS_KEPT per catalogue are kept
+SNAPSHOT_DIR = f"{OUTPUT_DIR}/snapshots"
+RUN_STAMP_FORMAT = "%Y-%m-%dT%H%M%S"
+SNAPSHOTS_KEPT = 30
+BFS_AGENCY_ID = "6e7f0c77-97de-44db-a32c-87bc73fa21c3"
+PAGE_SIZE = 1000
 
 # API URLs to get list of concepts
-i14y_url = "https://api.i14y.admin.ch/api/public/v1/concepts?publisherIdentifier=CH1&page=1&pageSize=10000"
-sms2_url = "https://sms-be.sis.bfs.admin.ch/api/DefinedVariables?page=1&pageSize=10000"
+I14Y_CATALOGUE_URL = ENVIRONMENTS["PROD"].public_concepts_url()
+SMS2_CATALOGUE_URL = "https://sms-be.sis.bfs.admin.ch/api/DefinedVariables"
+
+
+def iter_i14y_catalogue(token, publisher: str = "CH1", page_size: int = PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yields the I14Y concepts of a publisher page by page."""
+    return iter_pages(I14Y_CATALOGUE_URL, token, page_size=page_size, items_key="data",
+                      params={"publisherIdentifier": publisher})
 
-# Fetch data from both APIs
-i14y_data = _api_get_request(i14y_url, I14Y_token)
-sms2_data = _api_get_request(sms2_url, SMS2_token)
 
-# Save responses to files (useful for debugging)
-if i14y_data:
-    with open("SMS2_concept_importer/output/i14y_response.json", "w", encoding="utf-8") as f:
-        json.dump(i14y_data, f, indent=2)
+def iter_sms2_catalogue(token, page_size: int = PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yields all SMS2 defined variables page by page."""
+    return iter_pages(SMS2_CATALOGUE_URL, token, page_size=page_size)
 
-if sms2_data:
-    with open("SMS2_concept_importer/output/sms2_response.json", "w", encoding="utf-8") as f:
-        json.dump(sms2_data, f, indent=2)
 
-print("API responses saved to 'output/i14y_response.json' and 'output/sms2_response.json'")
+def filter_agency(items: Iterable[Dict[str, Any]], agency_id: str = BFS_AGENCY_ID) -> Iterator[Dict[str, Any]]:
+    """Keeps only the DVs of one agency (BFS by default)."""
+    return (item for item in items if item.get("agencyId") == agency_id)
 
 
-# Filter SMS2 data by agencyId (so we only keep the DVs of the Agency BFS, and not the other agencies)
-filtered_sms2_data = [item for item in sms2_data if item.get("agencyId") == "6e7f0c77-97de-44db-a32c-87bc73fa21c3"]
+def tee_to_ndjson(items: Iterable[Dict[str, Any]], path: str) -> Iterator[Dict[str, Any]]:
+    """Passes the items through while writing each one as a line to an NDJSON file (gzip if path ends in .gz)."""
+    # Fastest gzip level: the dump is written while the pages arrive and must not slow down the download
+    opener = (lambda: gzip.open(path, "wt", encoding="utf-8", compresslevel=1)) if path.endswith(".gz") \
+        else (lambda: open(path, "w", encoding="utf-8"))
+    with opener() as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False))
+            f.write("\n")
+            yield item
 
-# Extract identifier-version mappings
-sms2_dict = extract_identifiers_and_versions(filtered_sms2_data)
-#print(sms2_dict)
-i14y_dict = extract_identifiers_and_versions(i14y_data, "data")
-#print(i14y_dict)
 
-# Compare the two dictionaries
-only_in_i14y = {k: v for k, v in i14y_dict.items() if k not in sms2_dict}
-only_in_sms2 = {k: v for k, v in sms2_dict.items() if k not in i14y_dict}
-version_mismatches = {
-    k: {"i14y_versions": sorted(i14y_dict[k]), "sms2_versions": sorted(sms2_dict[k])}
-    for k in i14y_dict
-    if k in sms2_dict and sorted(i14y_dict[k]) != sorted(sms2_dict[k])
-}
+def list_snapshots(name: str) -> List[str]:
+    """Snapshot paths of one catalogue ("sms2" or "i14y"), oldest run first."""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    suffix = f"_{name}.snap"
+    return sorted(os.path.join(SNAPSHOT_DIR, file) for file in os.listdir(SNAPSHOT_DIR) if file.endswith(suffix))
 
-# Save differences to files
-with open("SMS2_concept_importer/output/only_in_i14y.json", "w", encoding="utf-8") as f:
-    json.dump(only_in_i14y, f, indent=2)
 
-with open("SMS2_concept_importer/output/only_in_sms2.json", "w", encoding="utf-8") as f:
-    json.dump(only_in_sms2, f, indent=2)
+def select_snapshot(name: str, run: str) -> Optional[str]:
+    """Newest snapshot of a catalogue whose run stamp starts with `run` (a date or a run stamp), or the
+    newest of all for "latest"."""
+    prefix = "" if run == "latest" else run
+    matching = [path for path in list_snapshots(name) if os.path.basename(path).startswith(prefix)]
+    return matching[-1] if matching else None
 
-with open("SMS2_concept_importer/output/version_mismatches.json", "w", encoding="utf-8") as f:
-    json.dump(version_mismatches, f, indent=2)
 
-print("Differences saved to 'output' folder.")
+def prune_snapshots(name: str, keep: int = SNAPSHOTS_KEPT):
+    for path in list_snapshots(name)[:-keep]:
+        os.remove(path)
+
+
+def compare_versions(sms2_dict: Dict[str, List[str]], i14y_dict: Dict[str, List[str]]):
+    """Returns the identifiers only in I14Y, only in SMS2, and those whose versions differ."""
+    only_in_i14y = {k: v for k, v in i14y_dict.items() if k not in sms2_dict}
+    only_in_sms2 = {k: v for k, v in sms2_dict.items() if k not in i14y_dict}
+    version_mismatches = {
+        k: {"i14y_versions": sorted(i14y_dict[k]), "sms2_versions": sorted(sms2_dict[k])}
+        for k in i14y_dict
+        if k in sms2_dict and sorted(i14y_dict[k]) != sorted(sms2_dict[k])
+    }
+    return only_in_i14y, only_in_sms2, version_mismatches
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare the BFS DVs in SMS2 with the CH1 concepts in I14Y.")
+    parser.add_argument("--drift", action="store_true",
+                        help="Also compare the content of versions present on both sides, not only the versions")
+    parser.add_argument("--from-snapshot", metavar="RUN", default=None,
+                        help="Compare the snapshots of an earlier run instead of downloading the catalogues: "
+                             "'latest', a date (2026-10-17, last run of that day) or a run stamp (2026-10-17T020000)")
+    parser.add_argument("--sms2-snapshot", default=None,
+                        help="Compare with this SMS2 snapshot instead of downloading the SMS2 catalogue")
+    parser.add_argument("--i14y-snapshot", default=None,
+                        help="Compare with this I14Y snapshot instead of downloading the I14Y catalogue")
+    parser.add_argument("--log-level", default=os.environ.get("SMS2_log_level", "INFO"),
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    for path in (args.sms2_snapshot, args.i14y_snapshot):
+        if path and not os.path.isfile(path):
+            parser.error(f"Snapshot {path} does not exist")
+    # An explicit path takes precedence over the run selected with --from-snapshot
+    snapshot_paths = {"sms2": args.sms2_snapshot, "i14y": args.i14y_snapshot}
+    if args.from_snapshot:
+        for name, path in snapshot_paths.items():
+            if path is None:
+                path = select_snapshot(name, args.from_snapshot)
+                if path is None:
+                    runs = [os.path.basename(p)[:-len(f"_{name}.snap")] for p in list_snapshots(name)]
+                    parser.error(f"No {name} snapshot of run '{args.from_snapshot}' in {SNAPSHOT_DIR} "
+                                 f"(available: {', '.join(runs[-10:]) or 'none'})")
+                snapshot_paths[name] = path
+            logger.info("%s catalogue from snapshot '%s'", name.upper(), path)
+
+    SMS2_token = os.environ.get("SMS2_token")
+    I14Y_token = os.environ.get("I14Y_token")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    run_stamp = time.strftime(RUN_STAMP_FORMAT)
+
+    fingerprint_fields = DRIFT_FIELDS if args.drift else None
+
+    def load_side(name: str, snapshot_path: Optional[str], items: Callable[[], Iterable[Dict[str, Any]]],
+                  fingerprint_fn: Callable[[Dict[str, Any]], str]):
+        """Index of one catalogue: from a snapshot, or downloaded page by page and saved as snapshot."""
+        if snapshot_path:
+            with span(f"load_{name}_snapshot"):
+                return load_index(snapshot_path, fingerprint_fields)
+        # The raw items are written as compressed NDJSON (useful for debugging) without holding them in memory
+        index = build_index(tee_to_ndjson(items(), f"{OUTPUT_DIR}/{name}_response.ndjson.gz"),
+                            fingerprint_fn if args.drift else None)
+        snapshot_path = f"{SNAPSHOT_DIR}/{run_stamp}_{name}.snap"
+        write_snapshot(snapshot_path, index, name, fingerprint_fields)
+        prune_snapshots(name)
+        logger.info("%s catalogue saved to 'output/%s_response.ndjson.gz', snapshot '%s'",
+                    name.upper(), name, snapshot_path)
+        return index
+
+    # Both catalogues are downloaded at the same time and indexed by (identifier, version) while the pages
+    # arrive. SMS2 is filtered by agencyId, so we only keep the DVs of the Agency BFS.
+    try:
+        with span("load_catalogues"):
+            i14y_index, sms2_index = get_client().gather(
+                (load_side, "i14y", snapshot_paths["i14y"], lambda: iter_i14y_catalogue(I14Y_token), i14y_fingerprint),
+                (load_side, "sms2", snapshot_paths["sms2"], lambda: filter_agency(iter_sms2_catalogue(SMS2_token)),
+                 sms2_fingerprint),
+            )
+    except SnapshotError as e:
+        parser.error(str(e))
+
+    # Machine-readable plan of what to migrate, input for SMS2_batch_migration.py --plan
+    with span("migration_plan"):
+        plan = migration_plan(sms2_index, i14y_index, DRIFT_FIELDS)
+    with open(f"{OUTPUT_DIR}/migration_plan.json", "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2)
+    logger.info("Migration plan: %s", plan["summary"])
+
+    # Compare the two dictionaries
+    only_in_i14y, only_in_sms2, version_mismatches = compare_versions(
+        versions_by_identifier(sms2_index), versions_by_identifier(i14y_index))
+
+    # Save differences to files
+    with open(f"{OUTPUT_DIR}/only_in_i14y.json", "w", encoding="utf-8") as f:
+        json.dump(only_in_i14y, f, indent=2)
+
+    with open(f"{OUTPUT_DIR}/only_in_sms2.json", "w", encoding="utf-8") as f:
+        json.dump(only_in_sms2, f, indent=2)
+
+    with open(f"{OUTPUT_DIR}/version_mismatches.json", "w", encoding="utf-8") as f:
+        json.dump(version_mismatches, f, indent=2)
+
+    logger.info("Differences saved to 'output' folder.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,71 @@
 import json
-import requests
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 from typing import Optional, Dict, Any, List
 
+from api_client import get_client, list_items
+from codelist_cache import get_cache
+from codelist_hierarchy import CodeListHierarchy
+from codelist_stream import CodeListEntries, codelist_payload
+from codelist_upload import upload_chunked
+from concept_mapping import PUBLISHER_IDENTIFIER, concept_type_of, map_concept
+from environments import get_environment
+from instrumentation import configure_logging, logger, span, timed
+from person_resolver import PersonResolver
+
+import logging
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
+# Set SMS2_debug_output=1 in .env to write the intermediate payloads of every DV to the output folder
+DEBUG_OUTPUT = os.environ.get("SMS2_debug_output") == "1"
+OUTPUT_DIR = "SMS2_concept_importer/output"
+
+# Code lists with more entries than SMS2_codelist_chunk_size are uploaded in chunks of that size,
+# up to SMS2_codelist_upload_parallelism chunks at the same time. Unset: one upload per code list.
+CODELIST_CHUNK_SIZE = int(os.environ.get("SMS2_codelist_chunk_size", 0)) or None
+CODELIST_UPLOAD_PARALLELISM = int(os.environ.get("SMS2_codelist_upload_parallelism", 4))
+
+# Console log level (DEBUG also logs every HTTP response and the duration of each stage)
+LOG_LEVEL = os.environ.get("SMS2_log_level", "INFO")
+
+
+def write_debug_output(DV, name: str, data):
+    """Writes an intermediate payload to output/<identifier>_<version>_<name>.json if DEBUG_OUTPUT is set."""
+    if not DEBUG_OUTPUT:
+        return
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = f"{OUTPUT_DIR}/{DV['identifier']}_{DV['version']}_{name}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        # CodeListEntries are written as the list of their entries
+        json.dump(data, f, indent=4, default=list)
+
 def _api_get_request(url: str, token) -> Optional[Dict[str, Any]]:
     """Make a GET request to the API and return JSON response."""
     headers = {
         'Content-Type': 'application/json',
         'Authorization': token
     }
-    response = requests.get(url, headers=headers, verify=False)
+    response = get_client().request("GET", url, headers=headers)
     if response.status_code == 200:
         return json.loads(response.content)
+    if response.status_code != 404:
+        logger.warning("GET %s failed with status %d: %s", url, response.status_code, response.text[:500])
     return None
 
+def _log_response(response):
+    """Logs the answer of a PUT/POST; the body is only logged at DEBUG and truncated."""
+    level = logging.DEBUG if response.ok else logging.WARNING
+    logger.log(level, "%s %s -> %d: %s", response.request.method, response.url, response.status_code,
+               response.text[:500], extra={"status": response.status_code})
+
 def _api_put_request(url: str, token) -> Optional[Dict[str, Any]]:
     """Make a PUT request to the API and return JSON response."""
     headers = {
         'Content-Type': 'application/json',
         'Authorization': token
     }
-    response = requests.put(url, headers=headers, verify=False)
-    print("Status Code:", response.status_code)
-    print("Response Text:", response.text)
+    response = get_client().request("PUT", url, headers=headers)
+    _log_response(response)
     return response
 
 
@@ -37,9 +75,8 @@ def _api_post_request(url, token, payload):
         "Authorization": token,
         "Content-Type": "application/json"
     }
-    response = requests.post(url, headers=headers, json=payload, verify=False)
-    print("Status Code:", response.status_code)
-    print("Response Text:", response.text)
+    response = get_client().request("POST", url, headers=headers, json=payload)
+    _log_response(response)
     return response
 
 
@@ -48,105 +85,90 @@ def _api_post_request_file(url, token, payload):
     headers = {
         "Authorization": token
     }
-    response = requests.post(url, headers=headers, files=payload, verify=False)
-    print("Status Code:", response.status_code)
-    print("Response Text:", response.text)
+    response = get_client().request("POST", url, headers=headers, files=payload)
+    _log_response(response)
     return response
 
 
+@timed("get_DV")
 def get_DV(dv_id: str, token) -> Optional[Dict[str, Any]]:
     """Gets the DV metadata"""
     url = f"https://sms-be.sis.bfs.admin.ch/api/DefinedVariables/{dv_id}"
     response = _api_get_request(url, token)
     if response is None:
-        print(f"Failed to fetch DV from URL: {url}")
+        logger.error("Failed to fetch DV from URL: %s", url)
     return response
 
 
+@timed("get_CL")
 def get_CL(cl_id: str, token) -> Optional[Dict[str, Any]]:
-    """gets the CL metadata"""
+    """gets the CL metadata (cached, revalidated with a conditional GET)"""
     url = f"https://sms-be.sis.bfs.admin.ch/api/CodeLists/{cl_id}"
-    return _api_get_request(url, token)
+    return get_cache().fetch(f"CL:{cl_id}", url, token)
 
 
-def get_CLE(cl_id: str, token) -> Optional[Dict[str, Any]]:
-    """gets the CLE metadata"""
+@timed("get_CLE")
+def get_CLE(cl_id: str, token, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """gets the CLE metadata (cached; the entries of a known CL version are not downloaded again)"""
+    url = f"https://sms-be.sis.bfs.admin.ch/api/CodeLists/{cl_id}/codeListEntries"
+    if version:
+        return get_cache().fetch(f"CLE:{cl_id}:{version}", url, token, immutable=True)
+    return get_cache().fetch(f"CLE:{cl_id}", url, token)
+
+@timed("get_CLE")
+def get_CLE_entries(cl_id: str, token, version: Optional[str] = None) -> Optional[CodeListEntries]:
+    """gets the CLE like get_CLE, but parses the response entry by entry and maps every entry (map_CLE)
+    right away, so large code lists are never held in memory as a whole (see codelist_stream.py)"""
     url = f"https://sms-be.sis.bfs.admin.ch/api/CodeLists/{cl_id}/codeListEntries"
-    return _api_get_request(url, token)
+    if version:
+        chunks = get_cache().fetch_stream(f"CLE:{cl_id}:{version}", url, token, immutable=True)
+    else:
+        chunks = get_cache().fetch_stream(f"CLE:{cl_id}", url, token)
+    if chunks is None:
+        return None
+    return CodeListEntries.from_json_array(chunks, map_CLE)
 
-def get_Person(email: str, token, environment="DEV") -> Optional[Dict[str, Any]]:
-    """gets the person metadata"""
-    base_urls = {
-        "DEV": f"https://core.i14y.d.c.bfs.admin.ch/api/Persons{email}",
-        "ABN": f"https://core.i14y.a.c.bfs.admin.ch/api/Persons{email}",
-        "PROD": f"https://dcat.app.cfap02.atlantica.admin.ch/api/Persons/{email}"
-    }
+@timed("get_CLE")
+def get_CLE_compressed(cl_id: str, token, version: Optional[str] = None) -> Optional[bytes]:
+    """gets the CLE like get_CLE, but returns the raw response zlib-compressed as it is cached, so it can be
+    handed to another process and parsed there (codelist_cache.iter_decompressed)"""
+    url = f"https://sms-be.sis.bfs.admin.ch/api/CodeLists/{cl_id}/codeListEntries"
+    if version:
+        return get_cache().fetch_compressed(f"CLE:{cl_id}:{version}", url, token, immutable=True)
+    return get_cache().fetch_compressed(f"CLE:{cl_id}", url, token)
 
-    base_url = base_urls.get(environment.upper())
-    if not base_url:
-        raise ValueError(
-            f"Invalid environment: {environment}. Choose from DEV, ABN, or PROD.")
-
-    return _api_get_request(base_url, token)
-
-def put_registrationStatus(conceptId, token, environment="DEV"):
-    base_urls = {
-        "DEV": f"https://api-d.i14y.admin.ch/api/partner/v1/concepts/{conceptId}/registration-status?status=Recorded",
-        "ABN": f"https://api-a.i14y.admin.ch/api/partner/v1/concepts/{conceptId}/registration-status?status=Recorded",
-        "PROD": f"https://api.i14y.admin.ch/api/partner/v1/concepts/{conceptId}/registration-status?status=Recorded"
-        #"DEV": f"https://api-d.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/registration-status?status=Recorded",
-        #"REF": f"https://api-r.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/registration-status?status=Recorded",
-        #"ABN": f"https://api-a.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/registration-status?status=Recorded",
-        #"PROD": f"https://api.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/registration-status?status=Recorded"
+def get_Person(email: str, token, environment="DEV") -> Optional[Dict[str, Any]]:
+    """gets the person metadata, None only if the person does not exist (404)"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': token
     }
+    response = get_client().request("GET", get_environment(environment).person_url(email), headers=headers)
+    if response.status_code == 404:
+        return None
+    # Any other failure (401, 5xx, 429 after the retries) must not be taken for a missing person
+    response.raise_for_status()
+    return json.loads(response.content) if response.content else None
 
-    base_url = base_urls.get(environment.upper())
-    if not base_url:
-        raise ValueError(
-            f"Invalid environment: {environment}. Choose from DEV, ABN, or PROD.")
+@timed("put_registrationStatus")
+def put_registrationStatus(conceptId, token, environment="DEV", status="Recorded"):
+    url = get_environment(environment).partner_concepts_url(conceptId, f"registration-status?status={status}")
 
     # Put registrationStatus for concept
-    response = _api_put_request(base_url, token)
+    response = _api_put_request(url, token)
     return response
 
-def put_publicationLevel(conceptId, token, environment="DEV"):
-    base_urls = {
-        "DEV": f"https://api-d.i14y.admin.ch/api/partner/v1/concepts/{conceptId}/publication-level?level=Public",
-        "ABN": f"https://api-a.i14y.admin.ch/api/partner/v1/concepts/{conceptId}/publication-level?level=Public",
-        "PROD": f"https://api.i14y.admin.ch/api/partner/v1/concepts/{conceptId}/publication-level?level=Public"
-        #"DEV": f"https://api-d.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/publication-level?level=Public",
-        #"REF": f"https://api-r.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/publication-level?level=Public",
-        #"ABN": f"https://api-a.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/publication-level?level=Public",
-        #"PROD": f"https://api.app.cfap02.atlantica.admin.ch/api/concepts/{conceptId}/publication-level?level=Public"
-    }
-
-    base_url = base_urls.get(environment.upper())
-    if not base_url:
-        raise ValueError(
-            f"Invalid environment: {environment}. Choose from DEV, ABN, or PROD.")
+@timed("put_publicationLevel")
+def put_publicationLevel(conceptId, token, environment="DEV", level="Public"):
+    url = get_environment(environment).partner_concepts_url(conceptId, f"publication-level?level={level}")
 
-    # Put registrationStatus for concept
-    response = _api_put_request(base_url, token)
+    # Put publicationLevel for concept
+    response = _api_put_request(url, token)
     return response
 
 def post_Person(iopPerson, token, environment="DEV") -> Optional[Dict[str, Any]]:
-    """gets the peron metadata"""
-    base_urls = {
-        "DEV": "https://core.i14y.d.c.bfs.admin.ch/api/Persons",
-        "ABN": "https://core.i14y.a.c.bfs.admin.ch/api/Persons",
-        "PROD": "https://dcat.app.cfap02.atlantica.admin.ch/api/Persons/"
-        #"DEV": "https://dcat-d.app.cfap02.atlantica.admin.ch/api/Persons/",
-        #"REF": "https://dcat-r.app.cfap02.atlantica.admin.ch/api/Persons/",
-        #"ABN": "https://dcat-a.app.cfap02.atlantica.admin.ch/api/Persons/",
-        #"PROD": "https://dcat.app.cfap02.atlantica.admin.ch/api/Persons/"
-    }
-
-    base_url = base_urls.get(environment.upper())
-    if not base_url:
-        raise ValueError(
-            f"Invalid environment: {environment}. Choose from DEV, ABN, or PROD.")
-
-    return _api_post_request(base_url, token, iopPerson)
+    """creates persons in the I14Y database"""
+    return _api_post_request(get_environment(environment).person_url(), token, iopPerson)
 
 
 def extract_and_capitalize_first_name(text: str) -> str:
@@ -202,236 +224,166 @@ def sort_codelist_entries(cle_data: List[Dict]) -> List[Dict]:
     come first.
 
     Args:
-        cle_data (List[Dict]): List of codelist entries to sort.
+        cle_data (List[Dict]): List of codelist entries to sort. CodeListEntries are sorted in place.
 
     Returns:
         List[Dict]: Sorted list of codelist entries.
+
+    Raises:
+        HierarchyError: If codes are duplicated, a parentCode is unknown or the entries contain a cycle.
     """
-    from collections import defaultdict, deque
+    if isinstance(cle_data, CodeListEntries):
+        return cle_data.sort()
+    return CodeListHierarchy(cle_data).sorted_entries()
 
-    # Build a graph and in-degree count
-    graph = defaultdict(list)
-    in_degree = defaultdict(int)
-    code_to_entry = {}
 
-    for entry in cle_data:
-        code = entry.get("code")
-        parent_code = entry.get("parentCode")
+# Create the JSON object to write to I14Y. The object is different depending on the type of the defined variable
+# (see CONCEPT_TYPES in concept_mapping.py). CLE_data is None for DVs without code list.
+@timed("map_DV")
+def map_DV(DV, token=None):
+    token = token or SMS2_token
+    concept_type = concept_type_of(DV)
+    CL = None
+    CLE_data = None
+    if concept_type.needs_codelist:
+        cl_id = DV["codeListId"]
+        # The CL version is the cache key of the entries, so a cached code list is never downloaded twice
+        CL = get_CL(cl_id, token)
+        if CL is None:
+            raise ValueError(f"Failed to fetch Code List (CL) with ID: {cl_id}")
+        # Streamed and mapped entry by entry, only codes and parent codes are kept in memory
+        mapped_cle_data = get_CLE_entries(cl_id, token, CL.get("version"))
+        if mapped_cle_data is None:
+            raise ValueError(f"Failed to fetch Code List Entries (CLE) of Code List: {cl_id}")
+        write_debug_output(DV, "CL", CL)
+        # Read back from the spooled entries (mapped, in SMS2 order), not downloaded a second time
+        write_debug_output(DV, "CLE", mapped_cle_data)
+
+        with span("sort_codelist_entries", entries=len(mapped_cle_data)):
+            sorted_cle_data = sort_codelist_entries(mapped_cle_data)
+        CLE_data = {"data": sorted_cle_data}
 
-        code_to_entry[code] = entry  # Map code to the entry for quick lookup
+        write_debug_output(DV, "I14Y_codelistentries", CLE_data)
 
-        if parent_code:
-            graph[parent_code].append(code)
-            in_degree[code] += 1
+    concept_data = map_concept(DV, CL)
 
-        # Ensure all codes are in the in-degree map
-        if code not in in_degree:
-            in_degree[code] = 0
+    # Write the JSON object (concept) to a file
+    write_debug_output(DV, "concept", concept_data)
+    return concept_data, CLE_data
 
-    # Perform topological sort
-    sorted_entries = []
-    queue = deque([code for code in in_degree if in_degree[code] == 0])
+def new_person(email: str) -> Dict[str, str]:
+    """Builds the I14Y person for an e-mail address of the form firstname.lastname@domain"""
+    return {
+        "givenName": extract_between_dot_and_at_last_name(email),
+        "familyName": extract_and_capitalize_first_name(email),
+        "email": email
+    }
 
-    while queue:
-        current = queue.popleft()
-        if current in code_to_entry:
-            sorted_entries.append(code_to_entry[current])
 
-        for neighbor in graph[current]:
-            in_degree[neighbor] -= 1
-            if in_degree[neighbor] == 0:
-                queue.append(neighbor)
+_person_resolver = None
 
-    # Check for cycles (if there are entries left with in-degree > 0)
-    if len(sorted_entries) != len(cle_data):
-        raise ValueError("Cycle detected in codelist entries. Sorting not possible.")
 
-    return sorted_entries
+def get_person_resolver() -> PersonResolver:
+    """Returns the process-wide person resolver (lookups cached in state/person_cache.json)."""
+    global _person_resolver
+    if _person_resolver is None:
+        _person_resolver = PersonResolver(get_Person, post_Person)
+    return _person_resolver
 
 
-# Create the JSON object to write to I14Y. The object is different depending on the type of the defined variable
-def map_DV(DV):
-    if DV['definedVariableType'] == "CodeList":
-        cl_id = DV["codeListId"]
-        CL = get_CL(cl_id, SMS2_token)
-        json.dump(CL, open("SMS2_concept_importer/output/CL.json", "w"), indent=4)
-        CLE = get_CLE(cl_id, SMS2_token)
-        json.dump(CLE, open("SMS2_concept_importer/output/CLE.json", "w"), indent=4)
-
-        concept_data = {
-            "data": {
-                "conceptType": DV["definedVariableType"],
-                "codeListEntryValueType": CL["codeListEntryValueType"],
-                "codeListEntryValueMaxLength": CL["codeListEntryValueMaxLength"],
-                "conformsTo": DV["conformsTo"],
-                "description": DV["description"],
-                "identifier": DV["identifier"],
-                "keywords": [],
-                "name": DV["name"],
-                "publisher": {
-                    "identifier": "CH1"  # Change organisation to BFS (CH1) # i14y-test-organisation
-                },
-                "responsibleDeputy": {
-                    "email": DV["responsibleDeputy"]["identifier"]
-                },
-                "responsiblePerson": {
-                    "email": DV["responsiblePerson"]["identifier"]
-                },
-                "themes": [],
-                "validFrom": DV["validFrom"],
-                "validTo": DV.get("validTo", None),
-                "version": DV["version"],
-            }
-        }
+@timed("ensure_users")
+def ensure_users(emails, I14Y_token, environment="DEV"):
+    """Checks all e-mails at once and creates the missing persons in one bulk POST"""
+    created = get_person_resolver().ensure(emails, I14Y_token, environment, new_person=new_person)
+    if created:
+        logger.info("Created users in the I14Y Database: %s", [person["email"] for person in created])
+    return created
 
-        # Map and sort CLE data before writing to file
-        mapped_cle_data = [map_CLE(obj) for obj in CLE]
-        sorted_cle_data = sort_codelist_entries(mapped_cle_data)
-        CLE_data = {"data": sorted_cle_data}
 
-        json.dump(CLE_data, open(
-            "SMS2_concept_importer/output/I14Y_codelistentries.json", "w"), indent=4)
-
-    if DV['definedVariableType'] == "Numeric":
-        concept_data = {
-            "data": {
-                "conceptType": DV["definedVariableType"],
-                "maxValue": DV["maxValue"],
-                "measurementUnit": DV["measurementUnit"],
-                "minValue": DV["minValue"],
-                "numberDecimals": DV["numberDecimals"],
-                "conformsTo": DV["conformsTo"],
-                "description": DV["description"],
-                "identifier": DV["identifier"],
-                "keywords": [],
-                "name": DV["name"],
-                "publisher": {
-                    "identifier": "CH1"  # Change organisation to BFS (CH1) # i14y-test-organisation
-                },
-                "responsibleDeputy": {
-                    "email": DV["responsibleDeputy"]["identifier"]
-                },
-                "responsiblePerson": {
-                    "email": DV["responsiblePerson"]["identifier"]
-                },
-                "themes": [],
-                "validFrom": DV["validFrom"],
-                "validTo": DV.get("validTo", None),
-                "version": DV["version"],
-            }
-        }
+def check_users(iopPerson, I14Y_token, environment="DEV"):
+    logger.debug("Checking user %s", iopPerson)
+    created = ensure_users([iopPerson], I14Y_token, environment)
+    if created:
+        return created
+    else:
+        logger.debug("User is found in the I14Y Database")
+        return None
 
-    if DV['definedVariableType'] == "String":
-        concept_data = {
-            "data": {
-                "conceptType": DV["definedVariableType"],
-                "maxLength": DV["maxLength"],
-                "minLength": DV["minLength"],
-                "pattern": DV["pattern"],
-                "conformsTo": DV["conformsTo"],
-                "description": DV["description"],
-                "identifier": DV["identifier"],
-                "keywords": [],
-                "name": DV["name"],
-                "publisher": {
-                    "identifier": "CH1"  # Change organisation to BFS (CH1) # i14y-test-organisation
-                },
-                "responsibleDeputy": {
-                    "email": DV["responsibleDeputy"]["identifier"]
-                },
-                "responsiblePerson": {
-                    "email": DV["responsiblePerson"]["identifier"]
-                },
-                "themes": [],
-                "validFrom": DV["validFrom"],
-                "validTo": DV.get("validTo", None),
-                "version": DV["version"],
-            }
-        }
+def _partner_concepts_url(environment="DEV"):
+    return get_environment(environment).concepts
 
-    if DV['definedVariableType'] == "Date":
-        concept_data = {
-            "data": {
-                "conceptType": DV["definedVariableType"],
-                "pattern": DV["pattern"],
-                "conformsTo": DV["conformsTo"],
-                "description": DV["description"],
-                "identifier": DV["identifier"],
-                "keywords": [],
-                "name": DV["name"],
-                "publisher": {
-                    "identifier": "CH1"  # Change organisation to BFS (CH1) # i14y-test-organisation
-                },
-                "responsibleDeputy": {
-                    "email": DV["responsibleDeputy"]["identifier"]
-                },
-                "responsiblePerson": {
-                    "email": DV["responsiblePerson"]["identifier"]
-                },
-                "themes": [],
-                "validFrom": DV["validFrom"],
-                "validTo": DV.get("validTo", None),
-                "version": DV["version"],
-            }
-        }
 
-    # Write the JSON object (concept) to a file
-    json.dump(concept_data, open(
-        "SMS2_concept_importer/output/concept.json", "w"), indent=4)
-    return concept_data, CLE_data
+@timed("find_concept")
+def find_concept(identifier, version, I14Y_token, environment="DEV") -> Optional[str]:
+    """Returns the id of the CH1 concept with this identifier and version in I14Y, or None.
 
-def check_users(iopPerson, I14Y_token, environment="DEV"):
-    print(iopPerson)
-    iopPersonToCheck = get_Person(iopPerson, I14Y_token, environment)
-    print(iopPersonToCheck)
-    
-    if not iopPersonToCheck:
-        new_iopPersonToCheck = [
-            {
-                "givenName": extract_between_dot_and_at_last_name(iopPerson),
-                "familyName": extract_and_capitalize_first_name(iopPerson),
-                "email": iopPerson
-            }
-        ]
-        print(new_iopPersonToCheck)
-        post_Person(new_iopPersonToCheck, I14Y_token, environment)
-        return new_iopPersonToCheck
-    else:
-        print("User is found in the I14Y Database")
+    Uses the partner API, which also lists concepts that are not public yet (e.g. posted by a run that
+    crashed before the status calls).
+    """
+    base_url = get_environment(environment).partner_concepts_url()
+
+    params = {"conceptIdentifier": identifier, "publisherIdentifier": PUBLISHER_IDENTIFIER, "version": version}
+    response = get_client().request("GET", base_url, I14Y_token, params=params)
+    if response.status_code == 404:
         return None
+    # An unknown answer must not be taken for "not found", that would post a duplicate
+    response.raise_for_status()
+    for concept in list_items(response.json() if response.content else []):
+        if concept.get("identifier") == identifier and concept.get("version") == version:
+            return concept.get("id")
+    return None
 
-def post_DV(concept_data, CLE_data, DV, I14Y_token, environment="DEV"):
-    base_urls = {
-        "DEV": "https://partner.i14y.d.c.bfs.admin.ch/api/concepts",        
-        "ABN": "https://partner.i14y.a.c.bfs.admin.ch/api/concepts",
-        "PROD": "https://iop-partner.app.cfap02.atlantica.admin.ch/api/concepts"
-    }
 
-    base_url = base_urls.get(environment.upper())
-    if not base_url:
-        raise ValueError(
-            f"Invalid environment: {environment}. Choose from DEV, ABN, or PROD.")
+@timed("post_concept")
+def post_concept(concept_data, DV, I14Y_token, environment="DEV"):
+    """Posts the concept and returns the I14Y concept id"""
+    base_url = _partner_concepts_url(environment)
 
     # Post concept data
     response = _api_post_request(base_url, I14Y_token, concept_data)
+    # Never read an error body as concept id
+    response.raise_for_status()
     concept_id = response.text.strip('\"')
 
-    print("Migrated Defined Variable:", DV["identifier"])
-    print("Status Code:", response.status_code)
-    print("Response Text:", response.text)
+    logger.info("Migrated Defined Variable: %s %s -> %s", DV["identifier"], DV["version"], concept_id,
+                extra={"identifier": DV["identifier"], "version": DV["version"], "concept_id": concept_id})
+    return concept_id
 
-    # If it's a CodeList, post the codelist entries
-    if DV['definedVariableType'] == "CodeList":
-        url = f"{base_url}/{concept_id}/codelist-entries/imports/json"
-        print(url)
 
-        with open("SMS2_concept_importer/output/I14Y_codelistentries.json", "rb") as f:
-            files = {
-                "file": ("SMS2_concept_importer/output/I14Y_codelistentries.json", f, "application/json")
-            }
-            response = _api_post_request_file(url, I14Y_token, files)
-            print("Migrated codelist:", DV["codeListId"])
-            print("Status Code:", response.status_code)
+@timed("post_codelist_entries")
+def post_codelist_entries(concept_id, CLE_data, DV, I14Y_token, environment="DEV", chunk_size=None):
+    """Uploads the codelist entries of a concept, in hierarchy-safe chunks if chunk_size is set.
+
+    An interrupted chunked upload resumes after the last acknowledged chunk when it is called again
+    for the same concept.
+    """
+    chunk_size = chunk_size or CODELIST_CHUNK_SIZE
+    url = get_environment(environment).codelist_import_url(concept_id)
+    logger.debug("Uploading %d codelist entries to %s", len(CLE_data["data"]), url)
+
+    def upload(payload: bytes):
+        files = {
+            "file": ("I14Y_codelistentries.json", payload, "application/json")
+        }
+        response = _api_post_request_file(url, I14Y_token, files)
+        response.raise_for_status()
+        return response
+
+    if chunk_size and len(CLE_data["data"]) > chunk_size:
+        upload_chunked(concept_id, CLE_data["data"], upload, chunk_size, CODELIST_UPLOAD_PARALLELISM)
+    else:
+        # Serialized once in memory and sent as multipart file, no temp file involved
+        upload(codelist_payload(CLE_data["data"]))
+    logger.info("Migrated codelist: %s (%d entries)", DV["codeListId"], len(CLE_data["data"]),
+                extra={"codelist_id": DV["codeListId"], "entries": len(CLE_data["data"])})
+
+
+def post_DV(concept_data, CLE_data, DV, I14Y_token, environment="DEV"):
+    concept_id = post_concept(concept_data, DV, I14Y_token, environment)
+
+    # If it's a CodeList, post the codelist entries
+    if CLE_data is not None:
+        post_codelist_entries(concept_id, CLE_data, DV, I14Y_token, environment)
     return concept_id
 
 
@@ -442,14 +394,14 @@ def Copy_DV_to_I14Y(dv_id, SMS2_token, I14Y_token, I14Y_environment="DEV"):
         raise ValueError(f"Failed to fetch Defined Variable (DV) with ID: {dv_id}")
 
     # Map the DV to objects compatible with I14Y
-    concept_data, CLE_data = map_DV(DV)
-    
-    print(concept_data)
-    print(CLE_data)
+    concept_data, CLE_data = map_DV(DV, SMS2_token)
+    # The payloads themselves are written by SMS2_debug_output=1, a code list can be megabytes
+    logger.debug("Mapped %s %s: %d codelist entries", DV["identifier"], DV["version"],
+                 len(CLE_data["data"]) if CLE_data is not None else 0)
 
     # Check if the users exist in the I14Y database, and create the user if it does not exist
-    check_users(iopPerson = DV["responsibleDeputy"]["identifier"], I14Y_token = I14Y_token, environment=I14Y_environment)
-    check_users(iopPerson = DV["responsiblePerson"]["identifier"], I14Y_token = I14Y_token, environment=I14Y_environment)
+    ensure_users([DV["responsibleDeputy"]["identifier"], DV["responsiblePerson"]["identifier"]],
+                 I14Y_token, I14Y_environment)
 
     # Post the new objects to I14Y
     concept_id = post_DV(concept_data, CLE_data, DV, I14Y_token,
@@ -460,15 +412,16 @@ def Copy_DV_to_I14Y(dv_id, SMS2_token, I14Y_token, I14Y_environment="DEV"):
 # Variables
 SMS2_token = os.environ.get("SMS2_token")
 I14Y_token = os.environ.get("I14Y_token") # requires IOS token
-I14Y_environment="PROD" # or "REF", "ABN", "PROD"
-
-dv_id = "08de1d3a-97f0-6516-bf36-9155692466ee"
-# dv_id = "08da3722-3590-881d-ab32-5591e8942da4"# AREA_NOAS
-# dv_id = "08d9e176-b0cf-c0fe-abab-861d6026f0ac"# LAND_TRADE_PARTNER
-# dv_id = "08dac62e-ab42-57fc-8db1-9e36ad2655c1" # DV_COM_CHANNEL_EUROPASS
+I14Y_environment=os.environ.get("I14Y_environment", "PROD") # or "REF", "ABN", "PROD"
 
+if __name__ == "__main__":
+    configure_logging(LOG_LEVEL)
+    dv_id = "08de1d3a-97f0-6516-bf36-9155692466ee"
+    # dv_id = "08da3722-3590-881d-ab32-5591e8942da4"# AREA_NOAS
+    # dv_id = "08d9e176-b0cf-c0fe-abab-861d6026f0ac"# LAND_TRADE_PARTNER
+    # dv_id = "08dac62e-ab42-57fc-8db1-9e36ad2655c1" # DV_COM_CHANNEL_EUROPASS
 
-concept_id = Copy_DV_to_I14Y(dv_id, SMS2_token, I14Y_token, I14Y_environment=I14Y_environment)
+    concept_id = Copy_DV_to_I14Y(dv_id, SMS2_token, I14Y_token, I14Y_environment=I14Y_environment)
 
-put_registrationStatus(concept_id, I14Y_token, environment=I14Y_environment)
-put_publicationLevel(concept_id, I14Y_token, environment=I14Y_environment)
\ No newline at end of file
+    put_registrationStatus(concept_id, I14Y_token, environment=I14Y_environment)
+    put_publicationLevel(concept_id, I14Y_token, environment=I14Y_environment)
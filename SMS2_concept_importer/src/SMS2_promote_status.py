@@ -0,0 +1,270 @@
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple
+
+from api_client import iter_pages
+from concept_mapping import PUBLISHER_IDENTIFIER
+from environments import ENVIRONMENTS, get_environment
+from instrumentation import configure_logging, export_metrics, logger, metrics, span
+from SMS2_check_new_versions import tee_to_ndjson
+from SMS2_concept_importer import put_registrationStatus, put_publicationLevel
+
+OUTPUT_DIR = "SMS2_concept_importer/output"
+
+# Values accepted by the registration-status and publication-level endpoints of the partner API
+REGISTRATION_STATUSES = ("Incomplete", "Candidate", "Recorded", "Qualified", "Standard", "PreferredStandard",
+                         "Superseded", "Retired")
+PUBLICATION_LEVELS = ("Internal", "Public")
+
+# Concepts changed at the same time; the ApiClient still applies its per-host connection and rate limits
+DEFAULT_PARALLELISM = 8
+# A saved catalogue younger than this is used instead of downloading it again (--catalogue-max-age)
+DEFAULT_CATALOGUE_MAX_AGE_MIN = 15
+PROGRESS_INTERVAL_S = 5.0
+
+# Catalogue field and importer function of every change, in the order they are applied
+CHANGES = (
+    ("registrationStatus", put_registrationStatus),
+    ("publicationLevel", put_publicationLevel),
+)
+
+
+def catalogue_path(environment: str, publisher: str, suffix: str = "") -> str:
+    return f"{OUTPUT_DIR}/i14y_{environment}_{publisher}_concepts{suffix}.ndjson.gz"
+
+
+def iter_partner_catalogue(token, environment: str, publisher: str = PUBLISHER_IDENTIFIER) -> Iterator[Dict[str, Any]]:
+    """Yields the concepts of a publisher page by page, including the ones that are not public."""
+    return iter_pages(get_environment(environment).partner_concepts_url(), token, items_key="data",
+                      params={"publisherIdentifier": publisher})
+
+
+def read_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_catalogue(token, environment: str, publisher: str, max_age_s: float) -> Dict[str, Dict[str, Any]]:
+    """Returns {concept id: concept} of a publisher.
+
+    The catalogue saved by an earlier run is used if it is younger than max_age_s, otherwise it is downloaded
+    and saved again (only once it was read completely, so a failed download never leaves a partial file).
+    """
+    path = catalogue_path(environment, publisher)
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age_s:
+        logger.info("Using the %s catalogue of %s saved %.0f minutes ago ('%s')", environment, publisher,
+                    (time.time() - os.path.getmtime(path)) / 60, path)
+        with span("load_catalogue"):
+            return {item["id"]: item for item in read_ndjson(path) if item.get("id")}
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    tmp_path = catalogue_path(environment, publisher, ".tmp")
+    with span("load_catalogue"):
+        catalogue = {item["id"]: item
+                     for item in tee_to_ndjson(iter_partner_catalogue(token, environment, publisher), tmp_path)
+                     if item.get("id")}
+    os.replace(tmp_path, path)
+    logger.info("%s catalogue of %s: %d concepts, saved to '%s'", environment, publisher, len(catalogue), path)
+    return catalogue
+
+
+def save_catalogue(catalogue: Dict[str, Dict[str, Any]], environment: str, publisher: str):
+    """Writes the catalogue with the states set by this run, keeping the time it was downloaded."""
+    path = catalogue_path(environment, publisher)
+    tmp_path = catalogue_path(environment, publisher, ".tmp")
+    downloaded = os.path.getmtime(path) if os.path.exists(path) else time.time()
+    for _ in tee_to_ndjson(catalogue.values(), tmp_path):
+        pass
+    os.replace(tmp_path, path)
+    os.utime(path, (time.time(), downloaded))
+
+
+def matches(concept: Dict[str, Any], identifier: Optional[str] = None, version: Optional[str] = None,
+            concept_type: Optional[str] = None) -> bool:
+    """Whether a catalogue concept passes the filters (identifier is a glob pattern, e.g. AREA_*)."""
+    if identifier and not fnmatch.fnmatchcase(concept.get("identifier") or "", identifier):
+        return False
+    if version and concept.get("version") != version:
+        return False
+    if concept_type and concept.get("conceptType") != concept_type:
+        return False
+    return True
+
+
+def select_concepts(catalogue: Dict[str, Dict[str, Any]], concept_ids: Iterable[str],
+                    identifier: Optional[str] = None, version: Optional[str] = None,
+                    concept_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """The concepts to change: the given ids, or every catalogue concept if none are given, narrowed by the
+    filters. Ids missing in the catalogue are kept (their state is unknown) unless a filter is set."""
+    concept_ids = list(dict.fromkeys(concept_ids))
+    filtered = bool(identifier or version or concept_type)
+    if not concept_ids:
+        return [concept for concept in catalogue.values() if matches(concept, identifier, version, concept_type)]
+
+    selected = []
+    for concept_id in concept_ids:
+        concept = catalogue.get(concept_id)
+        if concept is None:
+            if filtered:
+                logger.warning("Concept %s is not in the catalogue and cannot be filtered, skipped", concept_id)
+            else:
+                selected.append({"id": concept_id})
+        elif matches(concept, identifier, version, concept_type):
+            selected.append(concept)
+    return selected
+
+
+def pending_changes(concept: Dict[str, Any], targets: Dict[str, Optional[str]]) -> List[Tuple[str, str]]:
+    """(field, value) of every target the concept is not in yet."""
+    return [(field, targets[field]) for field, _ in CHANGES
+            if targets.get(field) and concept.get(field) != targets[field]]
+
+
+def concept_ids_of_report(path: str) -> List[str]:
+    """Concept ids of a batch_report.json written by SMS2_batch_migration.py (migrated and skipped DVs)."""
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return [result["concept_id"] for result in report.get("results", [])
+            if result.get("concept_id") and result.get("status") in ("migrated", "skipped")]
+
+
+def run_promotion(concepts: List[Dict[str, Any]], targets: Dict[str, Optional[str]], token, environment="DEV",
+                  parallelism: int = DEFAULT_PARALLELISM, dry_run: bool = False) -> List[Dict[str, Any]]:
+    """Brings every concept to the target registration status and publication level.
+
+    Concepts already in the target state are skipped. The others are changed `parallelism` at a time,
+    registration status before publication level; a failed PUT (after the ApiClient's retries) fails
+    only its concept. Progress and throughput are logged every PROGRESS_INTERVAL_S seconds.
+    """
+    results = []
+    todo = []
+    for concept in concepts:
+        result = {"id": concept["id"], "identifier": concept.get("identifier"), "version": concept.get("version"),
+                  "changes": dict(pending_changes(concept, targets)), "error": None}
+        result["status"] = ("planned" if dry_run else "pending") if result["changes"] else "skipped"
+        results.append(result)
+        if result["changes"]:
+            todo.append((concept, result))
+    logger.info("%d concepts to change in %s, %d already in the target state", len(todo), environment,
+                len(results) - len(todo))
+    if dry_run or not todo:
+        return results
+
+    lock = threading.Lock()
+    done = {"promoted": 0, "failed": 0}
+    start = time.perf_counter()
+    last_report = start
+
+    def promote(concept: Dict[str, Any], result: Dict[str, Any]):
+        for field, put in CHANGES:
+            if field in result["changes"]:
+                put(concept["id"], token, environment, result["changes"][field]).raise_for_status()
+                # Keeps the saved catalogue in line with I14Y
+                concept[field] = result["changes"][field]
+
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="promote") as executor:
+        futures = {executor.submit(promote, concept, result): result for concept, result in todo}
+        for future in as_completed(futures):
+            result = futures[future]
+            error = future.exception()
+            if error is None:
+                result["status"] = "promoted"
+            else:
+                result.update(status="failed", error=f"{type(error).__name__}: {error}")
+                logger.error("FAILED %s (%s %s): %s", result["id"], result["identifier"], result["version"],
+                             result["error"], extra={"concept_id": result["id"], "error": result["error"]})
+            metrics.inc("status_promotions_total", result=result["status"], environment=environment)
+            with lock:
+                done[result["status"]] += 1
+                finished = done["promoted"] + done["failed"]
+                now = time.perf_counter()
+                if now - last_report >= PROGRESS_INTERVAL_S or finished == len(todo):
+                    last_report = now
+                    logger.info("[%d/%d] %d changed, %d failed, %.1f concepts/s", finished, len(todo),
+                                done["promoted"], done["failed"], finished / (now - start),
+                                extra={"finished": finished, "total": len(todo)})
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Set the registration status and/or publication level of many I14Y concepts at once.")
+    parser.add_argument("concept_ids", nargs="*", help="I14Y concept ids")
+    parser.add_argument("--ids-file", action="append", default=[], help="Text file with one concept id per line")
+    parser.add_argument("--batch-report", action="append", default=[],
+                        help="batch_report.json of SMS2_batch_migration.py, promotes the concepts it migrated")
+    parser.add_argument("--all", action="store_true", help="Every concept of the publisher (narrowed by the filters)")
+    parser.add_argument("--publisher", default=PUBLISHER_IDENTIFIER)
+    parser.add_argument("--identifier", default=None, help="Only concepts whose identifier matches, e.g. AREA_*")
+    parser.add_argument("--version", default=None, help="Only concepts of this version")
+    parser.add_argument("--type", dest="concept_type", default=None, help="Only concepts of this type, e.g. CodeList")
+    parser.add_argument("--status", choices=REGISTRATION_STATUSES, default=None, help="Target registration status")
+    parser.add_argument("--level", choices=PUBLICATION_LEVELS, default=None, help="Target publication level")
+    parser.add_argument("--environment", default="DEV", choices=list(ENVIRONMENTS))
+    parser.add_argument("--parallelism", type=int, default=DEFAULT_PARALLELISM,
+                        help="Concepts changed at the same time")
+    parser.add_argument("--catalogue-max-age", type=float, default=DEFAULT_CATALOGUE_MAX_AGE_MIN,
+                        help="Minutes a saved catalogue is used before it is downloaded again (0: always download)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be changed")
+    parser.add_argument("--report", default=None, help="Default: output/status_report_<ENV>.json")
+    parser.add_argument("--log-level", default=os.environ.get("SMS2_log_level", "INFO"),
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--log-json", default=None, help="Also write every log record (DEBUG included) as JSON lines")
+    parser.add_argument("--metrics-prom", default=None, help="Write the run's metrics as Prometheus textfile")
+    args = parser.parse_args(argv)
+    if not args.status and not args.level:
+        parser.error("Give a target --status and/or --level")
+    concept_ids = list(args.concept_ids)
+    try:
+        for path in args.ids_file:
+            with open(path, "r", encoding="utf-8") as f:
+                concept_ids.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        for path in args.batch_report:
+            concept_ids.extend(concept_ids_of_report(path))
+    except OSError as e:
+        parser.error(str(e))
+    if not concept_ids and not (args.all or args.identifier or args.version or args.concept_type):
+        parser.error("Give concept ids, a filter (--identifier, --version, --type) or --all")
+
+    configure_logging(args.log_level, args.log_json)
+    token = get_environment(args.environment).token()
+    catalogue = load_catalogue(token, args.environment, args.publisher, args.catalogue_max_age * 60)
+    concepts = select_concepts(catalogue, concept_ids, args.identifier, args.version, args.concept_type)
+
+    start = time.perf_counter()
+    targets = {"registrationStatus": args.status, "publicationLevel": args.level}
+    results = run_promotion(concepts, targets, token, args.environment, args.parallelism, args.dry_run)
+    elapsed = time.perf_counter() - start
+    if not args.dry_run:
+        save_catalogue(catalogue, args.environment, args.publisher)
+
+    summary = {status: sum(1 for r in results if r["status"] == status)
+               for status in ("promoted", "skipped", "failed", "planned")}
+    summary.update(total=len(results), elapsed_s=round(elapsed, 3),
+                   concepts_per_s=round(summary["promoted"] / elapsed, 2) if elapsed and summary["promoted"] else None)
+    report = args.report or f"{OUTPUT_DIR}/status_report_{args.environment}.json"
+    os.makedirs(os.path.dirname(report) or ".", exist_ok=True)
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump({"environment": args.environment, "targets": targets, "summary": summary, "results": results},
+                  f, indent=2)
+    export_metrics(prometheus_path=args.metrics_prom)
+
+    if args.dry_run:
+        logger.info("Dry run: %d of %d concepts would be changed. Report saved to '%s'", summary["planned"],
+                    summary["total"], report)
+    else:
+        logger.info("Changed %d/%d concepts in %.1f s, %d already in the target state, %d failed. Report saved to '%s'",
+                    summary["promoted"], summary["total"], elapsed, summary["skipped"], summary["failed"], report)
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
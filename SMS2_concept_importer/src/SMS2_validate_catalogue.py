@@ -0,0 +1,356 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from typing import Optional, Dict, Any, List, Iterable, Iterator
+
+from api_client import get_client
+from codelist_cache import iter_decompressed
+from codelist_hierarchy import HierarchyError
+from codelist_stream import CodeListEntries
+from concept_mapping import CONCEPT_TYPES, MappingError, concept_type_of, map_concepts
+from instrumentation import configure_logging, export_metrics, logger, metrics
+from SMS2_batch_migration import collect_targets, prefetch_DVs
+from SMS2_check_new_versions import iter_sms2_catalogue, filter_agency
+from SMS2_concept_importer import (SMS2_token, get_DV, get_CL, get_CLE_compressed, map_CLE,
+                                   sort_codelist_entries)
+
+OUTPUT_DIR = "SMS2_concept_importer/output"
+
+# Processes that parse, map and sort the fetched DVs. All requests are sent from the main process through
+# the shared ApiClient, so its per-host connection and rate limits hold for the whole run
+DEFAULT_WORKERS = os.cpu_count() or 4
+# Fetched DVs waiting for a worker, per worker; bounds the compressed code lists held in memory
+QUEUED_PER_WORKER = 2
+PROGRESS_INTERVAL_S = 5.0
+
+PERSON_FIELDS = ("responsiblePerson", "responsibleDeputy")
+# Problem categories of the report, in the order they are listed in the summary
+CATEGORIES = (
+    "fetch_failed",          # DV, CL or CLE could not be downloaded from SMS2
+    "unknown_type",          # definedVariableType without a mapping in concept_mapping.CONCEPT_TYPES
+    "responsible_person",    # responsiblePerson / responsibleDeputy missing or not an e-mail address
+    "missing_max_length",    # code list without codeListEntryValueMaxLength
+    "missing_field",         # any other field required by the concept type
+    "codelist_cycle",        # sort_codelist_entries would raise: parentCode cycle,
+    "codelist_duplicates",   # duplicate codes,
+    "codelist_orphans",      # or parentCode of no entry
+    "error",                 # anything unexpected
+)
+
+
+def problem(category: str, message: str, **details) -> Dict[str, Any]:
+    return {"category": category, "message": message, **details}
+
+
+def new_result(dv_id: str, DV: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    DV = DV or {}
+    return {"dv_id": dv_id, "identifier": DV.get("identifier"), "version": DV.get("version"),
+            "type": DV.get("definedVariableType"), "entries": None, "problems": []}
+
+
+def fetch_inputs(dv_id: str, token) -> Dict[str, Any]:
+    """Downloads what map_DV needs for a DV: the DV, and for code list DVs the CL and the (compressed) CLE."""
+    job = {"dv_id": dv_id, "DV": None, "CL": None, "CLE": None, "problems": []}
+    try:
+        job["DV"] = DV = get_DV(dv_id, token)
+        if DV is None:
+            job["problems"].append(problem("fetch_failed", f"Failed to fetch Defined Variable (DV) with ID: {dv_id}"))
+            return job
+        try:
+            needs_codelist = concept_type_of(DV).needs_codelist
+        except MappingError:
+            return job  # Reported by the worker
+        if not needs_codelist:
+            return job
+        cl_id = DV.get("codeListId")
+        job["CL"] = CL = get_CL(cl_id, token) if cl_id else None
+        if CL is None:
+            job["problems"].append(problem("fetch_failed", f"Failed to fetch Code List (CL) with ID: {cl_id}"))
+            return job
+        job["CLE"] = get_CLE_compressed(cl_id, token, CL.get("version"))
+        if job["CLE"] is None:
+            job["problems"].append(
+                problem("fetch_failed", f"Failed to fetch Code List Entries (CLE) of Code List: {cl_id}"))
+    except Exception as e:
+        job["problems"].append(problem("error", f"{type(e).__name__}: {e}"))
+    return job
+
+
+def iter_fetched(dv_ids: Iterable[str], token, prefetch: int) -> Iterator[Dict[str, Any]]:
+    """Yields the fetch_inputs of every DV in order, with up to `prefetch` DVs downloading ahead."""
+    client = get_client()
+    window = deque()
+    for dv_id in dv_ids:
+        window.append(client.submit(fetch_inputs, dv_id, token))
+        if len(window) >= prefetch:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
+
+
+def person_problems(DV: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The responsible persons are created in I14Y from their e-mail address (see new_person). A missing
+    person field is reported by the mapping; this catches the ones that map to no usable address."""
+    problems = []
+    for field in PERSON_FIELDS:
+        person = DV.get(field)
+        if not isinstance(person, dict) or "identifier" not in person:
+            continue
+        email = person["identifier"]
+        if not email:
+            problems.append(problem("responsible_person", f"{field} is missing", field=field))
+        elif not isinstance(email, str) or "@" not in email:
+            problems.append(problem("responsible_person", f"{field} '{email}' is not an e-mail address", field=field))
+    return problems
+
+
+def mapping_category(field: Optional[str]) -> str:
+    """Report category of a MappingError, by the field it failed on."""
+    if field == "definedVariableType":
+        return "unknown_type"
+    if field in PERSON_FIELDS:
+        return "responsible_person"
+    if field == "codeListEntryValueMaxLength":
+        return "missing_max_length"
+    return "missing_field"
+
+
+def hierarchy_problems(error: HierarchyError) -> List[Dict[str, Any]]:
+    problems = []
+    if error.cycle:
+        problems.append(problem("codelist_cycle", "cycle detected: " + " -> ".join(error.cycle), cycle=error.cycle))
+    if error.duplicates:
+        problems.append(problem("codelist_duplicates", f"{len(error.duplicates)} duplicate code(s)",
+                                codes=list(error.duplicates)[:20]))
+    if error.orphans:
+        problems.append(problem("codelist_orphans", f"{len(error.orphans)} entry(ies) with unknown parentCode",
+                                codes=[code for code, _ in error.orphans[:20]]))
+    return problems or [problem("error", str(error))]
+
+
+def check_DV(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs the steps of map_DV on the fetched inputs of a DV and returns every problem that would make its
+    migration fail. Sends no request.
+
+    Runs in a worker process: never raises, unexpected exceptions are reported as problems.
+    """
+    start = time.perf_counter()
+    DV, CL = job["DV"], job["CL"]
+    result = new_result(job["dv_id"], DV)
+    problems = result["problems"]
+    problems.extend(job["problems"])
+    try:
+        problems.extend(person_problems(DV))
+        try:
+            concept_type = concept_type_of(DV)
+        except MappingError as e:
+            problems.append(problem(mapping_category(e.field), str(e)))
+            return result
+        if job["problems"]:
+            return result  # CL or CLE missing, the mapping would only repeat that
+
+        if job["CLE"] is not None:
+            # Parsed and mapped entry by entry like get_CLE_entries, then ordered like in map_DV
+            entries = CodeListEntries.from_json_array(iter_decompressed(job["CLE"]), map_CLE)
+            try:
+                result["entries"] = len(entries)
+                sort_codelist_entries(entries)
+            except HierarchyError as e:
+                problems.extend(hierarchy_problems(e))
+            finally:
+                entries.close()
+        # Every field map_concept would fail on, not only the first one
+        for field, message in concept_type.field_errors(DV, CL):
+            problems.append(problem(mapping_category(field), message, field=field))
+    except Exception as e:
+        problems.append(problem("error", f"{type(e).__name__}: {e}"))
+    finally:
+        result["elapsed_s"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def record_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Sets the status of a checked DV, counts it and logs its problems."""
+    result["status"] = "invalid" if result["problems"] else "valid"
+    metrics.inc("validation_total", status=result["status"])
+    for p in result["problems"]:
+        metrics.inc("validation_problems_total", category=p["category"])
+    if result["problems"]:
+        logger.warning("INVALID %s (%s %s): %s", result["dv_id"], result["identifier"], result["version"],
+                       "; ".join(p["message"] for p in result["problems"]),
+                       extra={"dv_id": result["dv_id"], "categories": [p["category"] for p in result["problems"]]})
+    return result
+
+
+def _init_worker(log_level: str):
+    configure_logging(log_level)
+
+
+def run_validation(dv_ids: List[str], token, workers: int = DEFAULT_WORKERS,
+                   log_level: str = "WARNING") -> List[Dict[str, Any]]:
+    """Validates the DVs and returns the results in the order of dv_ids.
+
+    The inputs of every DV are downloaded here, a few DVs ahead, through the shared ApiClient (and code list
+    cache). Parsing, mapping and sorting run in a pool of worker processes, which send no requests. Workers
+    are spawned, not forked, so they never inherit the connections and threads of this process.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    last_progress = time.monotonic()
+
+    def finished(result: Dict[str, Any]):
+        nonlocal last_progress
+        results[result["dv_id"]] = record_result(result)
+        if time.monotonic() - last_progress >= PROGRESS_INTERVAL_S:
+            last_progress = time.monotonic()
+            logger.info("Validated %d/%d DVs", len(results), len(dv_ids))
+
+    def collect(done: Iterable):
+        for future in done:
+            dv_id = futures.pop(future)
+            try:
+                finished(future.result())
+            except Exception as e:
+                # Only if the worker process itself died (e.g. out of memory)
+                result = new_result(dv_id)
+                result["problems"].append(problem("error", f"{type(e).__name__}: {e}"))
+                finished(result)
+
+    futures = {}
+    queued = workers * QUEUED_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(log_level,)) as pool:
+        for job in iter_fetched(dv_ids, token, prefetch=queued):
+            if job["DV"] is None:
+                result = new_result(job["dv_id"])
+                result["problems"].extend(job["problems"])
+                finished(result)
+                continue
+            futures[pool.submit(check_DV, job)] = job["dv_id"]
+            if len(futures) >= queued:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(as_completed(list(futures)))
+    return [results[dv_id] for dv_id in dv_ids]
+
+
+def run_mapping_only(DVs: List[Dict[str, Any]], token) -> List[Dict[str, Any]]:
+    """Maps the DVs in memory in one go (concept_mapping.map_concepts), without their code list entries.
+
+    Only the code list metadata is downloaded (cached). Finds unknown types and missing fields of a whole
+    catalogue in seconds, but only the first problem of every DV and no code list hierarchy problems.
+    """
+    client = get_client()
+    cl_ids = {DV.get("codeListId") for DV in DVs
+              if getattr(CONCEPT_TYPES.get(DV.get("definedVariableType")), "needs_codelist", False)}
+    cl_ids.discard(None)
+    futures = {cl_id: client.submit(get_CL, cl_id, token) for cl_id in cl_ids}
+    codelists = {cl_id: future.result() for cl_id, future in futures.items()}
+
+    results = {}
+    mappable = []
+    for DV in DVs:
+        result = results[DV["id"]] = new_result(DV["id"], DV)
+        result["problems"].extend(person_problems(DV))
+        cl_id = DV.get("codeListId")
+        if cl_id in codelists and codelists[cl_id] is None:
+            result["problems"].append(problem("fetch_failed", f"Failed to fetch Code List (CL) with ID: {cl_id}"))
+        else:
+            mappable.append(DV)
+
+    by_key = {(DV.get("identifier"), DV.get("version")): results[DV["id"]] for DV in mappable}
+    _, errors = map_concepts(mappable, {cl_id: CL for cl_id, CL in codelists.items() if CL is not None})
+    for error in errors:
+        by_key[(error["identifier"], error["version"])]["problems"].append(
+            problem(mapping_category(error["field"]), error["error"], field=error["field"]))
+    return [record_result(result) for result in results.values()]
+
+
+def summarize(results: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    results = list(results)
+    by_category = {category: [] for category in CATEGORIES}
+    for result in results:
+        for category in dict.fromkeys(p["category"] for p in result["problems"]):
+            by_category[category].append(result["identifier"] or result["dv_id"])
+    return {
+        "total": len(results),
+        "valid": sum(1 for r in results if r["status"] == "valid"),
+        "invalid": sum(1 for r in results if r["status"] == "invalid"),
+        "by_category": {category: {"count": len(dvs), "dvs": dvs} for category, dvs in by_category.items() if dvs},
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Check which BFS DVs would fail to migrate, without posting anything to I14Y.")
+    parser.add_argument("dv_ids", nargs="*",
+                        help="DV ids (GUID) or <identifier>@<version>. Default: all BFS DVs of the SMS2 catalogue")
+    parser.add_argument("--ids-file", action="append", default=[], help="Text file with one DV id per line")
+    parser.add_argument("--plan", action="append", default=[],
+                        help="Migration plan written by SMS2_check_new_versions.py --drift")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes")
+    parser.add_argument("--mapping-only", action="store_true",
+                        help="Only map the DVs in memory, without code list entries (first problem per DV)")
+    parser.add_argument("--report", default=os.path.join(OUTPUT_DIR, "validation_report.json"))
+    parser.add_argument("--log-level", default=os.environ.get("SMS2_log_level", "INFO"),
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--log-json", default=None, help="Also write every log record (DEBUG included) as JSON lines")
+    parser.add_argument("--metrics-prom", default=None, help="Write the run's metrics as Prometheus textfile")
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_level, args.log_json)
+    if args.dv_ids or args.ids_file or args.plan:
+        try:
+            targets = collect_targets(args.dv_ids, [], args.ids_file, SMS2_token, args.plan)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        unresolved = [t for t in targets if not t["dv_id"]]
+        for target in unresolved:
+            logger.error("No DV found for %s %s", target["identifier"], target["version"])
+        dv_ids = [t["dv_id"] for t in targets if t["dv_id"]]
+        catalogue = None
+    else:
+        unresolved = []
+        # The listing holds the complete DVs, which is all --mapping-only needs
+        catalogue = {item["id"]: item for item in filter_agency(iter_sms2_catalogue(SMS2_token)) if item.get("id")}
+        dv_ids = list(catalogue)
+
+    start = time.perf_counter()
+    if args.mapping_only:
+        fetched = catalogue if catalogue is not None else prefetch_DVs(dv_ids, SMS2_token)
+        logger.info("Mapping %d DVs", len(dv_ids))
+        results = run_mapping_only([DV for DV in fetched.values() if DV], SMS2_token)
+        for dv_id in dv_ids:
+            if not fetched.get(dv_id):
+                result = new_result(dv_id)
+                result["problems"].append(
+                    problem("fetch_failed", f"Failed to fetch Defined Variable (DV) with ID: {dv_id}"))
+                results.append(record_result(result))
+    else:
+        logger.info("Validating %d DVs with %d worker processes", len(dv_ids), args.workers)
+        # Workers only log problems; progress is logged here
+        results = run_validation(dv_ids, SMS2_token, args.workers,
+                                 "WARNING" if args.log_level == "INFO" else args.log_level)
+    elapsed = time.perf_counter() - start
+    summary = summarize(results)
+    summary.update(unresolved=len(unresolved), elapsed_s=round(elapsed, 3))
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "unresolved": unresolved,
+                   "invalid": [r for r in results if r["status"] == "invalid"],
+                   "valid": [r for r in results if r["status"] == "valid"]}, f, indent=2)
+    export_metrics(prometheus_path=args.metrics_prom)
+
+    logger.info("Validated %d DVs in %.1f s: %d would fail. Report saved to '%s'",
+                summary["total"], elapsed, summary["invalid"], args.report)
+    for category, entry in summary["by_category"].items():
+        logger.info("  %-20s %d", category, entry["count"])
+    return 0 if summary["invalid"] == 0 and not unresolved else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,324 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Callable, List, Tuple, Iterator
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+from environments import rate_limit_groups, rate_limits
+from instrumentation import logger, metrics, record_http
+
+# Maximum number of requests in flight per host. SMS2 is an internal backend and tolerates more
+# parallel reads than the I14Y partner/core APIs, which are shared with other publishers.
+HOST_LIMITS = {
+    "sms-be.sis.bfs.admin.ch": 8,
+}
+DEFAULT_HOST_LIMIT = 4
+MAX_WORKERS = 32
+
+# (connect, read) timeout in seconds. The read timeout is generous because large code lists take a while.
+DEFAULT_TIMEOUT = (10, 120)
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# 429/502/503/504 mean the request was not processed and can be repeated for every method.
+# 500 and read errors may happen after the server acted, so they are only retried for idempotent methods.
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_STATUSES_IDEMPOTENT = RETRY_STATUSES | {500}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+# Hosts that share a rate limit. Every I14Y environment is limited as a whole, independent of which
+# of its APIs (core, partner, public) is called (see environments.py). Hosts that are not listed are
+# limited on their own.
+RATE_LIMIT_GROUPS = {
+    "sms-be.sis.bfs.admin.ch": "SMS2",
+    **rate_limit_groups(),
+}
+# Requests per second and burst size per rate limit group
+RATE_LIMITS = {
+    "SMS2": (20.0, 40),
+    **rate_limits(),
+}
+DEFAULT_RATE_LIMIT = (10.0, 20)
+
+# SMS2_api_override=http://127.0.0.1:8765 sends every request to a local stand-in server (replay_server.py)
+# as http://127.0.0.1:8765/<original host>/<original path>. SMS2_record=<file> records all responses.
+API_OVERRIDE_ENV = "SMS2_api_override"
+RECORD_ENV = "SMS2_record"
+
+
+class TokenBucket:
+    """Blocking token bucket. `pause` lets a 429 Retry-After hold back every thread of the group."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def _retry_after(response) -> Optional[float]:
+    """Returns the delay requested by a Retry-After header (seconds or HTTP date), if any."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _body_size(body) -> int:
+    """Size of a prepared request body; streamed bodies (file objects, generators) are not counted."""
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    return 0
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _rewind_files(files):
+    """Moves file objects of a multipart upload back to the start so the upload can be repeated."""
+    values = files.values() if isinstance(files, dict) else [v for _, v in files]
+    for value in values:
+        fileobj = value[1] if isinstance(value, tuple) else value
+        if hasattr(fileobj, "seek"):
+            fileobj.seek(0)
+
+
+class ApiClient:
+    """Thread-pool based HTTP client with one pooled session and one concurrency limit per host.
+
+    The blocking methods (`request`) can be called from any thread. `submit` runs any callable on the
+    client's worker pool, so independent calls (e.g. get_CL and get_CLE) can run at the same time.
+    """
+
+    def __init__(self, host_limits: Optional[Dict[str, int]] = None, default_limit: int = DEFAULT_HOST_LIMIT,
+                 max_workers: int = MAX_WORKERS, timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                 max_retries: int = MAX_RETRIES, rate_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+                 base_override: Optional[str] = None, recorder=None):
+        self.base_override = base_override.rstrip("/") if base_override else None
+        self.recorder = recorder
+        self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+        self.default_limit = default_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limits = dict(RATE_LIMITS if rate_limits is None else rate_limits)
+        self._sessions: Dict[str, requests.Session] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api")
+
+    def _limit_for(self, host: str) -> int:
+        return self.host_limits.get(host, self.default_limit)
+
+    def _host_state(self, host: str):
+        with self._lock:
+            if host not in self._sessions:
+                limit = self._limit_for(host)
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.verify = False
+                self._sessions[host] = session
+                self._semaphores[host] = threading.BoundedSemaphore(limit)
+            return self._sessions[host], self._semaphores[host]
+
+    def _bucket_for(self, host: str) -> TokenBucket:
+        group = RATE_LIMIT_GROUPS.get(host, host)
+        with self._lock:
+            if group not in self._buckets:
+                self._buckets[group] = TokenBucket(*self.rate_limits.get(group, DEFAULT_RATE_LIMIT))
+            return self._buckets[group]
+
+    def _redirect(self, url: str) -> str:
+        if not self.base_override:
+            return url
+        parts = urlsplit(url)
+        return f"{self.base_override}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+    def request(self, method: str, url: str, token=None, headers: Optional[Dict[str, str]] = None,
+                **kwargs) -> requests.Response:
+        """Sends a request on the pooled session of the URL's host, waiting for a free slot if needed.
+
+        Retryable statuses and connection errors are retried with exponential backoff. The last response
+        is returned even if it is an error, so callers decide how to handle the status code.
+        """
+        host = urlsplit(url).netloc
+        session, semaphore = self._host_state(host)
+        bucket = self._bucket_for(host)
+        original_url = url
+        url = self._redirect(url)
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES_IDEMPOTENT if idempotent else RETRY_STATUSES
+        kwargs.setdefault("timeout", self.timeout)
+
+        request_headers = {}
+        if token is not None:
+            request_headers["Authorization"] = token
+        if headers:
+            request_headers.update(headers)
+
+        attempt = 0
+        while True:
+            if attempt and kwargs.get("files"):
+                _rewind_files(kwargs["files"])
+            bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with semaphore:
+                    response = session.request(method, url, headers=request_headers, **kwargs)
+            except (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError,
+                    requests.exceptions.ReadTimeout) as e:
+                record_http(host, method, type(e).__name__, time.perf_counter() - start)
+                # Only a failed connect guarantees the server never saw a non-idempotent request
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                logger.warning("%s %s failed (%s), retry %d", method, original_url, type(e).__name__, attempt + 1,
+                               extra={"host": host, "attempt": attempt + 1})
+                metrics.inc("http_retries_total", host=host)
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+
+            # A streamed body is read by the caller, its size is taken from the header
+            received = int(response.headers.get("Content-Length") or 0) if kwargs.get("stream") \
+                else len(response.content)
+            record_http(host, method, response.status_code, time.perf_counter() - start,
+                        sent=_body_size(response.request.body), received=received)
+            if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                if self.recorder is not None:
+                    self.recorder.record(method, original_url, response, stream=bool(kwargs.get("stream")))
+                return response
+
+            logger.info("%s %s answered %d, retry %d", method, original_url, response.status_code, attempt + 1,
+                        extra={"host": host, "status": response.status_code, "attempt": attempt + 1})
+            metrics.inc("http_retries_total", host=host)
+            response.close()
+            delay = _retry_after(response)
+            if delay is not None:
+                bucket.pause(delay)
+            time.sleep(delay if delay is not None else _backoff(attempt))
+            attempt += 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Runs fn(*args, **kwargs) on the client's worker pool."""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def gather(self, *calls) -> List[Any]:
+        """Runs several (fn, *args) tuples at the same time and returns their results in order."""
+        futures = [self.submit(call[0], *call[1:]) for call in calls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._semaphores.clear()
+
+
+_client: Optional[ApiClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ApiClient:
+    """Returns the process-wide client shared by all scripts."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            recorder = None
+            if os.environ.get(RECORD_ENV):
+                from replay_server import CassetteRecorder
+                recorder = CassetteRecorder(os.environ[RECORD_ENV])
+            _client = ApiClient(base_override=os.environ.get(API_OVERRIDE_ENV), recorder=recorder)
+        return _client
+
+
+def list_items(body: Any, items_key: Optional[str] = "data") -> List[Dict[str, Any]]:
+    """Items of a list response, which some endpoints return as a plain list and others as {items_key: [...]}."""
+    if isinstance(body, dict):
+        return body.get(items_key, []) if items_key else []
+    return body or []
+
+
+def iter_pages(url: str, token, page_size: int = 1000, items_key: Optional[str] = None,
+               params: Optional[Dict[str, Any]] = None, prefetch: int = 4) -> Iterator[Dict[str, Any]]:
+    """Yields the items of a paginated list endpoint (`page`/`pageSize` query parameters) one by one.
+
+    A page can be a plain list or an object with the items under `items_key` (see list_items).
+    Up to `prefetch` pages are downloaded at the same time while the caller consumes the current page.
+    Items are yielded in page order. The listing ends with the first page that is shorter than
+    `page_size`. A failing page raises instead of silently truncating the listing.
+    """
+    client = get_client()
+    base_params = dict(params or {})
+
+    def fetch(page: int) -> List[Dict[str, Any]]:
+        response = client.request("GET", url, token, headers={"Content-Type": "application/json"},
+                                  params={**base_params, "page": page, "pageSize": page_size})
+        if response.status_code != 200:
+            raise ValueError(f"GET {url} page {page} failed with status {response.status_code}")
+        return list_items(response.json(), items_key)
+
+    pending = deque()
+    next_page = 1
+    last_page_seen = False
+    try:
+        while True:
+            while not last_page_seen and len(pending) < prefetch:
+                pending.append(client.submit(fetch, next_page))
+                next_page += 1
+            if not pending:
+                return
+            items = pending.popleft().result()
+            if len(items) < page_size:
+                # Pages requested after the last one are empty, drop them
+                last_page_seen = True
+                for future in pending:
+                    future.cancel()
+                pending.clear()
+            yield from items
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, Iterator
+
+from api_client import get_client
+from instrumentation import logger, metrics
+
+DEFAULT_CACHE_PATH = "SMS2_concept_importer/cache/codelists.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+STREAM_CHUNK_BYTES = 256 * 1024
+
+
+class CodeListCache:
+    """Size-bounded on-disk cache of SMS2 responses, stored zlib-compressed in SQLite.
+
+    Entries are keyed by content (e.g. `CLE:<cl_id>:<version>`). Immutable keys are served without any
+    request; other keys are revalidated with a conditional GET (ETag / Last-Modified). When the cache grows
+    beyond `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                   key TEXT PRIMARY KEY,
+                   etag TEXT,
+                   last_modified TEXT,
+                   body BLOB NOT NULL,
+                   size INTEGER NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._db.commit()
+
+    def _load(self, key: str):
+        with self._lock:
+            return self._db.execute(
+                "SELECT etag, last_modified, body FROM entries WHERE key = ?", (key,)).fetchone()
+
+    def _touch(self, key: str):
+        with self._lock:
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+
+    def _store(self, key: str, content: bytes, etag: Optional[str], last_modified: Optional[str]):
+        self._store_compressed(key, zlib.compress(content), etag, last_modified)
+
+    def _store_compressed(self, key: str, body: bytes, etag: Optional[str], last_modified: Optional[str]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, etag, last_modified, body, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, etag, last_modified, body, len(body), time.time()))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _hit(self, key: str, revalidated: bool = False):
+        self._touch(key)
+        self.hits += 1
+        if revalidated:
+            self.revalidated += 1
+        metrics.inc("codelist_cache_total", result="revalidated" if revalidated else "hit")
+
+    def _get(self, key: str, url: str, token, cached, stream: bool = False):
+        """Sends the (conditional) GET of `url`. Returns None if the cached body is still valid."""
+        headers = {"Content-Type": "application/json"}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = get_client().request("GET", url, token, headers=headers, stream=stream)
+        if response.status_code == 304 and cached is not None:
+            response.close()
+            self._hit(key, revalidated=True)
+            return None
+        return response
+
+    def fetch(self, key: str, url: str, token, immutable: bool = False) -> Optional[Any]:
+        """Returns the JSON body of `url`, from the cache if it is still valid."""
+        cached = self._load(key)
+        if cached is not None and immutable:
+            self._hit(key)
+            return json.loads(zlib.decompress(cached[2]))
+
+        response = self._get(key, url, token, cached)
+        if response is None:
+            return json.loads(zlib.decompress(cached[2]))
+        if response.status_code != 200:
+            if response.status_code != 404:
+                logger.warning("GET %s failed with status %d: %s", url, response.status_code, response.text[:500])
+            return None
+
+        self.misses += 1
+        metrics.inc("codelist_cache_total", result="miss")
+        self._store(key, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return json.loads(response.content)
+
+    def fetch_stream(self, key: str, url: str, token, immutable: bool = False) -> Optional[Iterator[bytes]]:
+        """Like fetch, but returns the raw body as an iterator of byte chunks instead of the parsed JSON.
+
+        Neither a cached nor a downloaded body is ever held uncompressed in memory: cached bodies are
+        decompressed chunk by chunk, downloaded ones compressed while they stream through and stored once
+        they were read completely.
+        """
+        cached = self._load(key)
+        if cached is not None and immutable:
+            self._hit(key)
+            return iter_decompressed(cached[2])
+
+        response = self._get(key, url, token, cached, stream=True)
+        if response is None:
+            return iter_decompressed(cached[2])
+        if response.status_code != 200:
+            if response.status_code != 404:
+                logger.warning("GET %s failed with status %d: %s", url, response.status_code, response.text[:500])
+            response.close()
+            return None
+
+        self.misses += 1
+        metrics.inc("codelist_cache_total", result="miss")
+        return self._stored_while_read(key, response)
+
+    def fetch_compressed(self, key: str, url: str, token, immutable: bool = False) -> Optional[bytes]:
+        """Like fetch, but returns the body zlib-compressed as it is stored, e.g. to hand it to another
+        process (see iter_decompressed)."""
+        cached = self._load(key)
+        if cached is not None and immutable:
+            self._hit(key)
+            return cached[2]
+
+        response = self._get(key, url, token, cached, stream=True)
+        if response is None:
+            return cached[2]
+        if response.status_code != 200:
+            if response.status_code != 404:
+                logger.warning("GET %s failed with status %d: %s", url, response.status_code, response.text[:500])
+            response.close()
+            return None
+
+        self.misses += 1
+        metrics.inc("codelist_cache_total", result="miss")
+        compressor = zlib.compressobj()
+        with response:
+            body = b"".join(compressor.compress(chunk) for chunk in response.iter_content(STREAM_CHUNK_BYTES))
+        body += compressor.flush()
+        self._store_compressed(key, body, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return body
+
+    def _stored_while_read(self, key: str, response) -> Iterator[bytes]:
+        compressor = zlib.compressobj()
+        parts = []
+        with response:
+            for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                parts.append(compressor.compress(chunk))
+                yield chunk
+        parts.append(compressor.flush())
+        self._store_compressed(key, b"".join(parts), response.headers.get("ETag"),
+                               response.headers.get("Last-Modified"))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def iter_decompressed(body: bytes) -> Iterator[bytes]:
+    """The chunks of a body stored by the cache, decompressed one at a time."""
+    decompressor = zlib.decompressobj()
+    for start in range(0, len(body), STREAM_CHUNK_BYTES):
+        yield decompressor.decompress(body[start:start + STREAM_CHUNK_BYTES])
+    yield decompressor.flush()
+
+
+_cache: Optional[CodeListCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CodeListCache:
+    """Returns the process-wide code list cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CodeListCache()
+        return _cache
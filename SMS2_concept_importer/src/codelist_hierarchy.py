@@ -0,0 +1,146 @@
+from array import array
+from typing import Dict, List, Iterator, Optional, Sequence, Tuple
+
+# Values of the parent index array for entries without a usable parent
+NO_PARENT = -1
+ORPHAN = -2
+
+MAX_REPORTED = 10
+
+
+class HierarchyError(ValueError):
+    """Raised when codelist entries cannot be ordered. Carries the details of every problem found."""
+
+    def __init__(self, duplicates: Dict[str, List[int]], orphans: List[Tuple[str, str]],
+                 cycle: Optional[List[str]]):
+        self.duplicates = duplicates
+        self.orphans = orphans
+        self.cycle = cycle
+
+        problems = []
+        if duplicates:
+            codes = ", ".join(f"'{code}' (entries {positions})"
+                              for code, positions in list(duplicates.items())[:MAX_REPORTED])
+            problems.append(f"{len(duplicates)} duplicate code(s): {codes}")
+        if orphans:
+            codes = ", ".join(f"'{code}' -> '{parent}'" for code, parent in orphans[:MAX_REPORTED])
+            problems.append(f"{len(orphans)} entry(ies) with unknown parentCode: {codes}")
+        if cycle:
+            problems.append("cycle detected: " + " -> ".join(f"'{code}'" for code in cycle))
+        super().__init__("Sorting codelist entries not possible, " + "; ".join(problems))
+
+
+class CodeListHierarchy:
+    """Parent/child structure of a code list, stored as integer-indexed arrays.
+
+    Entries are indexed by their position in the input. `parents[i]` is the position of the parent of
+    entry i (NO_PARENT for roots, ORPHAN for unknown parent codes). The children of every entry are kept in
+    one flat array (`children[child_start[i]:child_start[i + 1]]`), so ordering 100k+ entries needs no
+    per-entry lists or dicts besides the code index.
+
+    Instead of the entries, only their codes and parent codes can be given (`codes`, `parent_codes`), e.g. for
+    entries that are not held in memory (see codelist_stream.CodeListEntries). The hierarchy can then be
+    checked and `order` used, but not iterated.
+    """
+
+    def __init__(self, entries: Optional[List[Dict]], code_key: str = "code", parent_key: str = "parentCode",
+                 codes: Optional[Sequence[str]] = None, parent_codes: Optional[Sequence[Optional[str]]] = None):
+        self.entries = entries
+        if codes is None:
+            codes = [entry.get(code_key) for entry in entries]
+            parent_codes = [entry.get(parent_key) for entry in entries]
+        self.codes = codes
+        n = len(codes)
+
+        index: Dict[str, int] = {}
+        self.duplicates: Dict[str, List[int]] = {}
+        for i, code in enumerate(codes):
+            if code in index:
+                self.duplicates.setdefault(code, [index[code]]).append(i)
+            else:
+                index[code] = i
+
+        self.parents = array("l", [NO_PARENT]) * n
+        self.orphans: List[Tuple[str, str]] = []
+        child_count = array("l", [0]) * (n + 1)
+        for i, parent_code in enumerate(parent_codes):
+            if not parent_code:
+                continue
+            parent = index.get(parent_code, ORPHAN)
+            self.parents[i] = parent
+            if parent == ORPHAN:
+                self.orphans.append((codes[i], parent_code))
+            else:
+                child_count[parent + 1] += 1
+
+        # Prefix sums give the slice of each entry in the flat children array
+        self.child_start = child_count
+        for i in range(n):
+            self.child_start[i + 1] += self.child_start[i]
+        self.children = array("l", [0]) * n
+        fill = array("l", self.child_start[:n])
+        for i, parent in enumerate(self.parents):
+            if parent >= 0:
+                self.children[fill[parent]] = i
+                fill[parent] += 1
+
+        self.order, self.depths = self._breadth_first()
+
+    def _breadth_first(self) -> Tuple[array, array]:
+        """Orders the entries root level first, keeping the input order within the children of a parent."""
+        depths = array("l", [-1]) * len(self.codes)
+        order = array("l", (i for i, parent in enumerate(self.parents) if parent == NO_PARENT))
+        for i in order:
+            depths[i] = 0
+        head = 0
+        while head < len(order):
+            current = order[head]
+            head += 1
+            children = self.children[self.child_start[current]:self.child_start[current + 1]]
+            for child in children:
+                depths[child] = depths[current] + 1
+            order.extend(children)
+        return order, depths
+
+    def find_cycle(self) -> Optional[List[str]]:
+        """Returns the codes of one cycle (child -> parent -> ... -> child), if any."""
+        for start in range(len(self.codes)):
+            if self.depths[start] != -1 or self.parents[start] == ORPHAN:
+                continue
+            # Entries that were not reached and have a known parent lead into a cycle or below an orphan
+            seen: Dict[int, int] = {}
+            path = []
+            current = start
+            while current >= 0 and current not in seen:
+                seen[current] = len(path)
+                path.append(current)
+                current = self.parents[current]
+            if current >= 0:
+                cycle = path[seen[current]:] + [current]
+                return [self.codes[i] for i in cycle]
+        return None
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.duplicates and not self.orphans and len(self.order) == len(self.codes)
+
+    def problems(self) -> Optional[HierarchyError]:
+        """Returns the error describing every problem of the hierarchy, or None if it can be ordered."""
+        if self.is_valid:
+            return None
+        return HierarchyError(self.duplicates, self.orphans, self.find_cycle())
+
+    def check(self):
+        error = self.problems()
+        if error is not None:
+            raise error
+
+    def iter_sorted(self) -> Iterator[Dict]:
+        """Yields the entries so that every parent comes before its children."""
+        self.check()
+        entries = self.entries
+        for i in self.order:
+            yield entries[i]
+
+    def sorted_entries(self) -> List[Dict]:
+        return list(self.iter_sorted())
@@ -0,0 +1,218 @@
+"""Streaming parse of SMS2 code list entries and a compact container for the mapped entries.
+
+The `/codeListEntries` response of a large code list is a JSON array of several hundred MB. Instead of
+loading it with json.loads, mapping it into a second list and sorting it into a third, the array is decoded
+one entry at a time from the response chunks, every entry is mapped right away and stored as compact JSON
+in a spooled temporary file. Only the code and parentCode of every entry stay in memory, which is all the
+hierarchy needs to compute the upload order.
+"""
+import codecs
+import json
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Callable, Sequence, Union
+
+from codelist_hierarchy import CodeListHierarchy
+
+# Mapped entries stay in memory up to this size before the spool file is moved to disk
+SPOOL_BYTES = 8 * 1024 * 1024
+# Appended entries are written to the spool file in blocks of this many entries
+WRITE_BLOCK = 1024
+WHITESPACE = " \t\n\r"
+ITEM_END = WHITESPACE + ",]"
+
+
+def iter_json_array(chunks: Iterable[bytes], decoder: json.JSONDecoder = json.JSONDecoder()) -> Iterator[Any]:
+    """Yields the items of a top-level JSON array read from byte chunks, without holding the whole document.
+
+    Every item is decoded with JSONDecoder.raw_decode as soon as it is complete in the buffer; an item split
+    across chunks is decoded again once the next chunk arrived. The chunks are read to their end even after
+    the closing bracket, so a reader that stores the body while it is read (codelist_cache) sees all of it.
+    """
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    eof = False
+    expect = "["
+
+    def more() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + text.decode(b"", final=True)
+        else:
+            buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if more():
+                continue
+            raise ValueError("Unexpected end of the JSON array")
+
+        char = buffer[pos]
+        if expect == "[":
+            if char == "\ufeff":
+                pos += 1
+                continue
+            if char != "[":
+                raise ValueError(f"Expected a JSON array, found {buffer[pos:pos + 20]!r}")
+            pos += 1
+            expect = "first"
+        elif expect in ("first", "item"):
+            if expect == "first" and char == "]":
+                pos += 1
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if more():
+                    continue
+                raise
+            # A number cut off by the end of the buffer (e.g. "2." of "2.5") continues in the next chunk
+            if (end == len(buffer) or buffer[end] not in ITEM_END) and more():
+                continue
+            pos = end
+            expect = "separator"
+            yield item
+        else:
+            if char == "]":
+                pos += 1
+                break
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in the JSON array, found {buffer[pos:pos + 20]!r}")
+            pos += 1
+            expect = "item"
+
+    while True:
+        if buffer[pos:].strip(WHITESPACE):
+            raise ValueError(f"Unexpected data after the JSON array: {buffer[pos:].lstrip(WHITESPACE)[:20]!r}")
+        if not more():
+            return
+
+
+class CodeListEntries:
+    """Mapped codelist entries, stored as compact JSON in a spooled temporary file.
+
+    Entries are appended in response order. In memory are only the file offsets (8 bytes per entry), the
+    codes and parent codes, and after `sort` the upload order. Indexing, slicing and iterating decode the
+    requested entries from the file, in upload order once sorted. `json_payload` builds the upload body
+    directly from the stored JSON, byte for byte the same as json.dumps({"data": entries}).
+    """
+
+    def __init__(self, spool_bytes: int = SPOOL_BYTES):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._offsets = array("Q", [0])
+        self.codes: List[Optional[str]] = []
+        self.parent_codes: List[Optional[str]] = []
+        self._order: Optional[array] = None
+        self._pending: List[bytes] = []
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_json_array(cls, chunks: Iterable[bytes],
+                        map_entry: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> "CodeListEntries":
+        """Parses a JSON array of entries from byte chunks and maps every entry as it is decoded."""
+        entries = cls()
+        for item in iter_json_array(chunks):
+            entries.append(map_entry(item) if map_entry else item)
+        return entries
+
+    def append(self, entry: Dict[str, Any]):
+        encoded = self._encode(entry).encode("utf-8")
+        self._pending.append(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+        self.codes.append(entry.get("code"))
+        parent_code = entry.get("parentCode")
+        # Siblings share one parent code string
+        self.parent_codes.append(sys.intern(parent_code) if isinstance(parent_code, str) else parent_code)
+        self._order = None
+        if len(self._pending) >= WRITE_BLOCK:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            self._file.seek(0, 2)
+            self._file.write(b"".join(self._pending))
+            self._pending = []
+
+    def sort(self) -> "CodeListEntries":
+        """Orders the entries so that every parent comes before its children (see CodeListHierarchy).
+
+        Raises HierarchyError like sort_codelist_entries if the entries cannot be ordered.
+        """
+        self._flush()
+        hierarchy = CodeListHierarchy(None, codes=self.codes, parent_codes=self.parent_codes)
+        hierarchy.check()
+        self._order = hierarchy.order
+        return self
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _position(self, i: int) -> int:
+        return self._order[i] if self._order is not None else i
+
+    def _raw(self, position: int) -> bytes:
+        start, end = self._offsets[position], self._offsets[position + 1]
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(end - start)
+
+    def iter_json(self, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """Yields the JSON of the entries start..stop in order."""
+        self._flush()
+        for i in range(*slice(start, stop).indices(len(self))):
+            yield self._raw(self._position(i))
+
+    def json_payload(self, start: int = 0, stop: Optional[int] = None) -> bytearray:
+        """The upload body {"data": [...]} of the entries start..stop, built in place without a list of parts."""
+        payload = bytearray(b'{"data": [')
+        for i, raw in enumerate(self.iter_json(start, stop)):
+            if i:
+                payload += b", "
+            payload += raw
+        payload += b"]}"
+        return payload
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("codelist entry index out of range")
+        self._flush()
+        return json.loads(self._raw(self._position(i)))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for raw in self.iter_json():
+            yield json.loads(raw)
+
+    def ordered_codes(self) -> Sequence[Optional[str]]:
+        return [self.codes[self._position(i)] for i in range(len(self))]
+
+    def ordered_parent_codes(self) -> Sequence[Optional[str]]:
+        return [self.parent_codes[self._position(i)] for i in range(len(self))]
+
+    def close(self):
+        self._file.close()
+
+
+def codelist_payload(entries, start: int = 0, stop: Optional[int] = None) -> Union[bytes, bytearray]:
+    """The upload body {"data": [...]} of the entries start..stop, for a list or CodeListEntries."""
+    if isinstance(entries, CodeListEntries):
+        return entries.json_payload(start, stop)
+    return json.dumps({"data": entries[start:stop]}, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Set, Callable, Sequence
+
+from codelist_stream import CodeListEntries, codelist_payload
+from instrumentation import logger
+
+DEFAULT_PROGRESS_DIR = "SMS2_concept_importer/state/codelist_uploads"
+
+
+def plan_chunks(sorted_entries: Sequence[Dict], chunk_size: int) -> List[Dict]:
+    """Splits topologically sorted entries into chunks and computes which chunks each chunk depends on.
+
+    Chunks are cut in sorted order, so a parent is always in the same or an earlier chunk than its
+    children. A chunk depends on the chunks that hold the parents of its entries; chunks without a
+    dependency between them can be uploaded at the same time. A chunk is the range start..stop of
+    sorted_entries (a list or codelist_stream.CodeListEntries, whose entries are not decoded for this).
+    """
+    if isinstance(sorted_entries, CodeListEntries):
+        codes, parent_codes = sorted_entries.ordered_codes(), sorted_entries.ordered_parent_codes()
+    else:
+        codes = [entry.get("code") for entry in sorted_entries]
+        parent_codes = [entry.get("parentCode") for entry in sorted_entries]
+    chunk_of: Dict[str, int] = {}
+    chunks = []
+    for start in range(0, len(codes), chunk_size):
+        index = len(chunks)
+        stop = min(start + chunk_size, len(codes))
+        depends_on: Set[int] = set()
+        for code, parent_code in zip(codes[start:stop], parent_codes[start:stop]):
+            if parent_code and parent_code in chunk_of and chunk_of[parent_code] != index:
+                depends_on.add(chunk_of[parent_code])
+            chunk_of[code] = index
+        chunks.append({"index": index, "start": start, "stop": stop, "depends_on": depends_on})
+    return chunks
+
+
+class UploadProgress:
+    """Remembers which chunks of a codelist upload the server acknowledged, in a JSON file per concept.
+
+    The file also stores a hash of the chunk plan, so a changed code list or chunk size starts over.
+    """
+
+    def __init__(self, concept_id: str, plan_hash: str, directory: str = DEFAULT_PROGRESS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{concept_id}.json")
+        self.plan_hash = plan_hash
+        self.acknowledged: Set[int] = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("plan_hash") == plan_hash:
+                self.acknowledged = set(saved.get("acknowledged", []))
+
+    def acknowledge(self, index: int):
+        with self._lock:
+            self.acknowledged.add(index)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"plan_hash": self.plan_hash, "acknowledged": sorted(self.acknowledged)}, f)
+            os.replace(tmp_path, self.path)
+
+    def complete(self):
+        """Removes the progress file once every chunk is uploaded."""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def upload_chunked(concept_id: str, sorted_entries: Sequence[Dict], upload: Callable[[bytes], object],
+                   chunk_size: int, max_parallel: int = 4, progress_dir: str = DEFAULT_PROGRESS_DIR):
+    """Uploads codelist entries in hierarchy-safe chunks with bounded parallelism.
+
+    `upload` receives the JSON body of one chunk (`{"data": [...]}`) and must raise if the server did not
+    accept it. Chunks acknowledged in an earlier, interrupted run of the same plan are not sent again.
+    """
+    chunks = plan_chunks(sorted_entries, chunk_size)
+
+    def body(chunk: Dict) -> bytes:
+        return codelist_payload(sorted_entries, chunk["start"], chunk["stop"])
+
+    # Bodies are built when they are hashed and again when they are sent, never all at once
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        if chunk["index"]:
+            digest.update(b"\n")
+        digest.update(body(chunk))
+    plan_hash = digest.hexdigest()
+    progress = UploadProgress(concept_id, plan_hash, progress_dir)
+    if progress.acknowledged:
+        logger.info("Resuming codelist upload of %s: %d/%d chunks already acknowledged",
+                    concept_id, len(progress.acknowledged), len(chunks))
+
+    pending = {chunk["index"] for chunk in chunks} - progress.acknowledged
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="cle-upload") as executor:
+        while pending or in_flight:
+            ready = [i for i in sorted(pending) if chunks[i]["depends_on"] <= progress.acknowledged]
+            for index in ready[:max_parallel - len(in_flight)]:
+                pending.discard(index)
+                in_flight[executor.submit(upload, body(chunks[index]))] = index
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                if future.exception() is not None:
+                    # Let the chunks already sent finish so their acknowledgement is kept for the resume
+                    wait(in_flight)
+                    for other, other_index in in_flight.items():
+                        if other.exception() is None:
+                            progress.acknowledge(other_index)
+                    raise future.exception()
+                progress.acknowledge(index)
+                logger.debug("Uploaded codelist chunk %d/%d (%d entries)", index + 1, len(chunks),
+                             chunks[index]["stop"] - chunks[index]["start"])
+
+    progress.complete()
@@ -0,0 +1,183 @@
+from operator import itemgetter
+from typing import Optional, Dict, Any, List, Callable, Iterable, Tuple
+
+PUBLISHER_IDENTIFIER = "CH1"  # Change organisation to BFS (CH1) # i14y-test-organisation
+
+# An extractor gets the DV and, for code lists, the SMS2 code list metadata (CL)
+Extractor = Callable[[Dict[str, Any], Optional[Dict[str, Any]]], Any]
+
+
+class MappingError(ValueError):
+    """Raised when a DV cannot be mapped to an I14Y concept."""
+
+    def __init__(self, DV: Dict[str, Any], message: str, field: Optional[str] = None):
+        self.identifier = DV.get("identifier") if isinstance(DV, dict) else None
+        self.version = DV.get("version") if isinstance(DV, dict) else None
+        self.field = field
+        super().__init__(f"DV {self.identifier} {self.version}: {message}")
+
+
+def dv(field: str) -> Extractor:
+    """Required field of the DV."""
+    get = itemgetter(field)
+    return lambda DV, CL: get(DV)
+
+
+def dv_optional(field: str) -> Extractor:
+    """Optional field of the DV, None if missing."""
+    return lambda DV, CL: DV.get(field, None)
+
+
+def cl(field: str) -> Extractor:
+    """Required field of the code list metadata."""
+    get = itemgetter(field)
+    return lambda DV, CL: get(CL)
+
+
+def person(field: str) -> Extractor:
+    """Responsible person of the DV, referenced by e-mail in I14Y."""
+    return lambda DV, CL: {"email": DV[field]["identifier"]}
+
+
+def const(value: Any) -> Extractor:
+    """Fixed value. Lists and dicts are copied so concepts never share them."""
+    if isinstance(value, (list, dict)):
+        return lambda DV, CL: type(value)(value)
+    return lambda DV, CL: value
+
+
+# Fields of every concept, after the fields of the concept type
+COMMON_FIELDS: List[Tuple[str, Extractor]] = [
+    ("conformsTo", dv("conformsTo")),
+    ("description", dv("description")),
+    ("identifier", dv("identifier")),
+    ("keywords", const([])),
+    ("name", dv("name")),
+    ("publisher", const({"identifier": PUBLISHER_IDENTIFIER})),
+    ("responsibleDeputy", person("responsibleDeputy")),
+    ("responsiblePerson", person("responsiblePerson")),
+    ("themes", const([])),
+    ("validFrom", dv("validFrom")),
+    ("validTo", dv_optional("validTo")),
+    ("version", dv("version")),
+]
+
+
+_COMMON_EXTRACTORS = dict(COMMON_FIELDS)
+
+
+class ConceptType:
+    """Mapping of one definedVariableType, compiled once into a single builder function."""
+
+    def __init__(self, name: str, fields: List[Tuple[str, Extractor]], needs_codelist: bool = False):
+        self.name = name
+        self.needs_codelist = needs_codelist
+        self.fields = [("conceptType", dv("definedVariableType"))] + list(fields) + COMMON_FIELDS
+        self.extractors = dict(self.fields)
+        extractors = tuple(self.fields)
+
+        def build(DV, CL):
+            return {field: extract(DV, CL) for field, extract in extractors}
+
+        self.build = build
+
+    def map(self, DV: Dict[str, Any], CL: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        try:
+            return {"data": self.build(DV, CL)}
+        except (KeyError, TypeError):
+            # Slow path only on errors: find out which field is missing
+            for field, message in self.field_errors(DV, CL):
+                raise MappingError(DV, message, field) from None
+            raise
+
+    def field_errors(self, DV: Dict[str, Any], CL: Optional[Dict[str, Any]] = None) -> List[Tuple[str, str]]:
+        """(field, message) of every field that cannot be mapped, empty if the DV maps."""
+        errors = []
+        for field, extract in self.fields:
+            try:
+                extract(DV, CL)
+            except (KeyError, TypeError) as e:
+                errors.append((field, f"cannot map field '{field}' of {self.name} concept, missing value {e}"))
+        return errors
+
+
+CONCEPT_TYPES: Dict[str, ConceptType] = {}
+
+
+def register_type(name: str, fields: List[Tuple[str, Extractor]], needs_codelist: bool = False) -> ConceptType:
+    """Adds (or replaces) the mapping of a definedVariableType."""
+    CONCEPT_TYPES[name] = ConceptType(name, fields, needs_codelist)
+    return CONCEPT_TYPES[name]
+
+
+register_type("CodeList", [
+    ("codeListEntryValueType", cl("codeListEntryValueType")),
+    ("codeListEntryValueMaxLength", cl("codeListEntryValueMaxLength")),
+], needs_codelist=True)
+register_type("Numeric", [
+    ("maxValue", dv("maxValue")),
+    ("measurementUnit", dv("measurementUnit")),
+    ("minValue", dv("minValue")),
+    ("numberDecimals", dv("numberDecimals")),
+])
+register_type("String", [
+    ("maxLength", dv("maxLength")),
+    ("minLength", dv("minLength")),
+    ("pattern", dv("pattern")),
+])
+register_type("Date", [
+    ("pattern", dv("pattern")),
+])
+
+
+def concept_type_of(DV: Dict[str, Any]) -> ConceptType:
+    concept_type = CONCEPT_TYPES.get(DV.get("definedVariableType"))
+    if concept_type is None:
+        raise MappingError(DV, f"unknown definedVariableType '{DV.get('definedVariableType')}', "
+                               f"supported: {', '.join(CONCEPT_TYPES)}", "definedVariableType")
+    return concept_type
+
+
+def map_concept(DV: Dict[str, Any], CL: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Maps a DV (and its code list metadata for CodeList DVs) to the I14Y concept payload."""
+    concept_type = concept_type_of(DV)
+    if concept_type.needs_codelist and CL is None:
+        raise MappingError(DV, f"code list {DV.get('codeListId')} is required to map a {concept_type.name} concept",
+                           "codeListId")
+    return concept_type.map(DV, CL)
+
+
+def map_fields(DV: Dict[str, Any], fields: Iterable[str], CL: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Values of some fields of the concept payload map_concept builds from the DV.
+
+    Never raises: fields that cannot be mapped (missing in the DV, code list fields without CL) are None, and
+    DVs of an unknown type get the fields every concept type has.
+    """
+    concept_type = CONCEPT_TYPES.get(DV.get("definedVariableType"))
+    extractors = concept_type.extractors if concept_type is not None else _COMMON_EXTRACTORS
+    values = {}
+    for field in fields:
+        extract = extractors.get(field)
+        try:
+            values[field] = extract(DV, CL) if extract is not None else None
+        except (KeyError, TypeError):
+            values[field] = None
+    return values
+
+
+def map_concepts(DVs: Iterable[Dict[str, Any]], codelists: Optional[Dict[str, Dict[str, Any]]] = None
+                 ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Maps many DVs in memory without any request.
+
+    `codelists` maps codeListId to the code list metadata. Returns the mapped concepts and one error record
+    (identifier, version, field, error) per DV that could not be mapped.
+    """
+    codelists = codelists or {}
+    concepts = []
+    errors = []
+    for DV in DVs:
+        try:
+            concepts.append(map_concept(DV, codelists.get(DV.get("codeListId"))))
+        except MappingError as e:
+            errors.append({"identifier": e.identifier, "version": e.version, "field": e.field, "error": str(e)})
+    return concepts, errors
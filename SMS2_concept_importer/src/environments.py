@@ -0,0 +1,94 @@
+import os
+from typing import Optional, Dict, Tuple
+
+
+class Environment:
+    """The API endpoints of one I14Y environment.
+
+    persons: core API person endpoint, concepts: partner API concept endpoint (post, codelist import),
+    partner_v1 and public_v1: base URLs of the versioned partner and public APIs. person_post: URL the new
+    persons are posted to, if it is not `persons` itself.
+    """
+
+    def __init__(self, name: str, persons: str, concepts: str, partner_v1: str, public_v1: str,
+                 rate_limit: Tuple[float, int] = (10.0, 20), person_post: Optional[str] = None):
+        self.name = name
+        self.persons = persons
+        self.person_post = person_post or persons
+        self.concepts = concepts
+        self.partner_v1 = partner_v1
+        self.public_v1 = public_v1
+        self.rate_limit = rate_limit
+
+    @property
+    def rate_limit_group(self) -> str:
+        return f"I14Y-{self.name}"
+
+    @property
+    def hosts(self):
+        return sorted({url.split("/")[2] for url in (self.persons, self.concepts, self.partner_v1, self.public_v1)})
+
+    def person_url(self, email: Optional[str] = None) -> str:
+        return f"{self.persons}/{email}" if email else self.person_post
+
+    def codelist_import_url(self, concept_id: str) -> str:
+        return f"{self.concepts}/{concept_id}/codelist-entries/imports/json"
+
+    def partner_concepts_url(self, concept_id: Optional[str] = None, action: Optional[str] = None) -> str:
+        url = f"{self.partner_v1}/concepts"
+        if concept_id:
+            url += f"/{concept_id}"
+        if action:
+            url += f"/{action}"
+        return url
+
+    def public_concepts_url(self) -> str:
+        return f"{self.public_v1}/concepts"
+
+    def token(self) -> Optional[str]:
+        """The I14Y token of this environment: I14Y_token_<NAME> in .env, else I14Y_token."""
+        return os.environ.get(f"I14Y_token_{self.name}") or os.environ.get("I14Y_token")
+
+
+ENVIRONMENTS: Dict[str, Environment] = {
+    "DEV": Environment(
+        "DEV",
+        persons="https://core.i14y.d.c.bfs.admin.ch/api/Persons",
+        concepts="https://partner.i14y.d.c.bfs.admin.ch/api/concepts",
+        partner_v1="https://api-d.i14y.admin.ch/api/partner/v1",
+        public_v1="https://api-d.i14y.admin.ch/api/public/v1",
+    ),
+    "ABN": Environment(
+        "ABN",
+        persons="https://core.i14y.a.c.bfs.admin.ch/api/Persons",
+        concepts="https://partner.i14y.a.c.bfs.admin.ch/api/concepts",
+        partner_v1="https://api-a.i14y.admin.ch/api/partner/v1",
+        public_v1="https://api-a.i14y.admin.ch/api/public/v1",
+    ),
+    "PROD": Environment(
+        "PROD",
+        persons="https://dcat.app.cfap02.atlantica.admin.ch/api/Persons",
+        # Persons are posted with the trailing slash on PROD, as before the registry
+        person_post="https://dcat.app.cfap02.atlantica.admin.ch/api/Persons/",
+        concepts="https://iop-partner.app.cfap02.atlantica.admin.ch/api/concepts",
+        partner_v1="https://api.i14y.admin.ch/api/partner/v1",
+        public_v1="https://api.i14y.admin.ch/api/public/v1",
+    ),
+}
+
+
+def get_environment(name: str) -> Environment:
+    environment = ENVIRONMENTS.get(name.upper())
+    if environment is None:
+        raise ValueError(f"Invalid environment: {name}. Choose from {', '.join(ENVIRONMENTS)}.")
+    return environment
+
+
+def rate_limit_groups() -> Dict[str, str]:
+    """Host -> rate limit group of every I14Y host, so each environment is limited as a whole."""
+    return {host: environment.rate_limit_group
+            for environment in ENVIRONMENTS.values() for host in environment.hosts}
+
+
+def rate_limits() -> Dict[str, Tuple[float, int]]:
+    return {environment.rate_limit_group: environment.rate_limit for environment in ENVIRONMENTS.values()}
@@ -0,0 +1,194 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger("sms2_importer")
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms with labels, exported as JSON lines or Prometheus textfile."""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            key = _labels(**labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            key = _labels(**labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        """Returns one dict per metric series."""
+        with self._lock:
+            rows = []
+            for name, series in self.counters.items():
+                for labels, value in series.items():
+                    rows.append({"metric": name, "type": "counter", "labels": dict(labels), "value": value})
+            for name, series in self.histograms.items():
+                for labels, histogram in series.items():
+                    rows.append({
+                        "metric": name, "type": "histogram", "labels": dict(labels),
+                        "count": histogram.count, "sum": round(histogram.sum, 6),
+                        "buckets": dict(zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts)),
+                    })
+            return rows
+
+    def write_jsonl(self, path: str):
+        timestamp = time.time()
+        with open(path, "a", encoding="utf-8") as f:
+            for row in self.snapshot():
+                f.write(json.dumps(dict(row, timestamp=timestamp)) + "\n")
+
+    def write_prometheus(self, path: str):
+        """Writes the metrics in the Prometheus textfile format (for the node exporter textfile collector)."""
+        lines = []
+        declared = set()
+        for row in self.snapshot():
+            name = f"sms2_{row['metric']}"
+            labels = ",".join(f'{k}="{v}"' for k, v in sorted(row["labels"].items()))
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {row['type']}")
+            if row["type"] == "counter":
+                lines.append(f"{name}{{{labels}}} {row['value']}")
+                continue
+            cumulative = 0
+            for bound, count in row["buckets"].items():
+                cumulative += count
+                bucket_labels = ",".join(filter(None, [labels, f'le="{bound}"']))
+                lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+            lines.append(f"{name}_sum{{{labels}}} {row['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {row['count']}")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        # Atomic replace, the textfile collector must never read a half-written file
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Times a stage: the duration goes to the stage_seconds histogram and a DEBUG log record."""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe("stage_seconds", duration, stage=stage)
+        metrics.inc("stage_total", stage=stage, status=status)
+        logger.debug("%s %s in %.3f s", stage, status, duration,
+                     extra={"stage": stage, "status": status, "duration_s": round(duration, 6), **fields})
+
+
+def timed(stage: str):
+    """Decorator version of `span`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_http(host: str, method: str, status, seconds: float, sent: int = 0, received: int = 0):
+    metrics.inc("http_requests_total", host=host, method=method, status=status)
+    metrics.observe("http_request_seconds", seconds, host=host)
+    if sent:
+        metrics.inc("http_bytes_total", sent, host=host, direction="sent")
+    if received:
+        metrics.inc("http_bytes_total", received, host=host, direction="received")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per log record, including the structured fields passed with `extra`."""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "INFO", json_path: Optional[str] = None):
+    """Console output at `level`; with json_path, every record (DEBUG included) is also written as JSON lines."""
+    logger.setLevel(logging.DEBUG)
+    logger.handlers.clear()
+    logger.propagate = False
+
+    console = logging.StreamHandler()
+    console.setLevel(getattr(logging, level.upper()))
+    console.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(console)
+
+    if json_path:
+        json_handler = logging.FileHandler(json_path, encoding="utf-8")
+        json_handler.setLevel(logging.DEBUG)
+        json_handler.setFormatter(JsonLinesFormatter())
+        logger.addHandler(json_handler)
+
+
+def export_metrics(jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> Dict[str, Any]:
+    if jsonl_path:
+        metrics.write_jsonl(jsonl_path)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
+    return {"jsonl": jsonl_path, "prometheus": prometheus_path}
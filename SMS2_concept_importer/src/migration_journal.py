@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+DEFAULT_JOURNAL_PATH = "SMS2_concept_importer/state/migration_journal.sqlite"
+
+# Steps with side effects in I14Y, in the order they run for a DV
+STEPS = ("post_concept", "upload_codelist", "registration_status", "publication_level")
+STARTED = "started"
+DONE = "done"
+
+
+class MigrationJournal:
+    """Write-ahead journal of the I14Y steps of every DV migration.
+
+    A step is marked `started` before its request is sent and `done` with the returned ids once it
+    succeeded. After a crash, `started` steps are the ones whose outcome is unknown: the post is checked
+    against I14Y before it is sent again, and completed steps are never repeated.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Every change is on disk before the request it announces is sent
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(
+            """CREATE TABLE IF NOT EXISTS steps (
+                   environment TEXT NOT NULL,
+                   dv_id TEXT NOT NULL,
+                   step TEXT NOT NULL,
+                   status TEXT NOT NULL,
+                   concept_id TEXT,
+                   detail TEXT,
+                   updated_at REAL NOT NULL,
+                   PRIMARY KEY (environment, dv_id, step)
+               );"""
+        )
+        self._db.commit()
+
+    def _write(self, environment: str, dv_id: str, step: str, status: str, concept_id: Optional[str],
+               detail: Optional[Dict[str, Any]]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO steps (environment, dv_id, step, status, concept_id, detail, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (environment, dv_id, step, status, concept_id, json.dumps(detail) if detail else None, time.time()))
+            self._db.commit()
+
+    def begin(self, environment: str, dv_id: str, step: str, concept_id: Optional[str] = None):
+        self._write(environment, dv_id, step, STARTED, concept_id, None)
+
+    def done(self, environment: str, dv_id: str, step: str, concept_id: Optional[str] = None,
+             detail: Optional[Dict[str, Any]] = None):
+        self._write(environment, dv_id, step, DONE, concept_id, detail)
+
+    def steps(self, environment: str, dv_id: str) -> Dict[str, Dict[str, Any]]:
+        """Returns {step: {status, concept_id, detail, updated_at}} of a DV."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT step, status, concept_id, detail, updated_at FROM steps WHERE environment = ? AND dv_id = ?",
+                (environment, dv_id)).fetchall()
+        return {
+            row[0]: {"status": row[1], "concept_id": row[2], "detail": json.loads(row[3]) if row[3] else None,
+                     "updated_at": row[4]}
+            for row in rows
+        }
+
+    def is_done(self, environment: str, dv_id: str, step: str) -> bool:
+        return self.steps(environment, dv_id).get(step, {}).get("status") == DONE
+
+    def is_complete(self, environment: str, dv_id: str) -> bool:
+        steps = self.steps(environment, dv_id)
+        return all(steps.get(step, {}).get("status") == DONE for step in STEPS)
+
+    def incomplete(self, environment: str) -> List[str]:
+        """DV ids with at least one journaled step that have not finished every step."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT dv_id FROM steps WHERE environment = ? GROUP BY dv_id "
+                "HAVING SUM(status = ?) < ?", (environment, DONE, len(STEPS))).fetchall()
+        return [row[0] for row in rows]
+
+    def forget(self, environment: str, dv_id: str):
+        """Drops the steps of a DV, so it is migrated from the start (--force)."""
+        with self._lock:
+            self._db.execute("DELETE FROM steps WHERE environment = ? AND dv_id = ?", (environment, dv_id))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
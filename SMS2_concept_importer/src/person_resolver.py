@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Callable, Iterable
+
+DEFAULT_PERSON_CACHE_PATH = "SMS2_concept_importer/state/person_cache.json"
+# Found persons rarely disappear, missing ones may be created by someone else in the meantime
+POSITIVE_TTL = 7 * 24 * 3600
+NEGATIVE_TTL = 10 * 60
+LOOKUP_PARALLELISM = 4
+
+
+class PersonResolver:
+    """Makes sure I14Y persons exist, with a persisted cache of positive and negative lookups.
+
+    `lookup(email, token, environment)` returns the person, a falsy value if it does not exist, and raises
+    if it cannot tell (failed request). `create(persons, token, environment)` creates a list of persons in
+    one request. Results are cached per environment and e-mail; a failed lookup is not cached and fails
+    the `ensure` call instead of creating the person again.
+    """
+
+    def __init__(self, lookup: Callable, create: Callable, path: Optional[str] = DEFAULT_PERSON_CACHE_PATH,
+                 positive_ttl: float = POSITIVE_TTL, negative_ttl: float = NEGATIVE_TTL):
+        self.lookup = lookup
+        self.create = create
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.lookups = 0
+        self.created = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Serializes ensure() per environment, so two workers that need the same missing person do not
+        # both create it
+        self._ensure_locks: Dict[str, threading.Lock] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def _key(email: str, environment: str) -> str:
+        return f"{environment.upper()}:{email.strip().lower()}"
+
+    def _cached(self, key: str) -> Optional[bool]:
+        """Returns True/False for a valid cached lookup, None if the person must be looked up."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        ttl = self.positive_ttl if entry["found"] else self.negative_ttl
+        if time.time() - entry["checked_at"] > ttl:
+            return None
+        return entry["found"]
+
+    def _remember(self, key: str, found: bool):
+        self._entries[key] = {"found": found, "checked_at": time.time()}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+
+    def ensure(self, emails: Iterable[str], token, environment: str = "DEV",
+               new_person: Callable[[str], Dict[str, str]] = None) -> List[Dict[str, str]]:
+        """Looks up every distinct e-mail once and creates all missing persons in a single bulk request.
+
+        Returns the persons that were created. Concurrent calls for the same environment run one after
+        another; after the first call, the persons it created are cache hits for the others.
+        """
+        with self._lock:
+            ensure_lock = self._ensure_locks.setdefault(environment.upper(), threading.Lock())
+        with ensure_lock:
+            return self._ensure(emails, token, environment, new_person)
+
+    def _ensure(self, emails: Iterable[str], token, environment: str,
+                new_person: Optional[Callable[[str], Dict[str, str]]]) -> List[Dict[str, str]]:
+        # E-mail addresses are compared case-insensitively, the first spelling is the one looked up
+        unique_by_key = {}
+        for email in emails:
+            if email:
+                unique_by_key.setdefault(self._key(email, environment), email)
+        unique = list(unique_by_key.values())
+        with self._lock:
+            known = {email: self._cached(self._key(email, environment)) for email in unique}
+            to_lookup = [email for email, found in known.items() if found is None]
+            self.hits += len(unique) - len(to_lookup)
+            self.lookups += len(to_lookup)
+
+        if to_lookup:
+            with ThreadPoolExecutor(max_workers=LOOKUP_PARALLELISM) as executor:
+                results = list(executor.map(lambda email: bool(self.lookup(email, token, environment)), to_lookup))
+            with self._lock:
+                for email, found in zip(to_lookup, results):
+                    known[email] = found
+                    self._remember(self._key(email, environment), found)
+
+        missing = [email for email, found in known.items() if not found]
+        persons = [new_person(email) if new_person else {"email": email} for email in missing]
+        if persons:
+            response = self.create(persons, token, environment)
+            if hasattr(response, "raise_for_status"):
+                response.raise_for_status()
+            with self._lock:
+                for email in missing:
+                    self._remember(self._key(email, environment), True)
+                self.created += len(persons)
+
+        # Cache hits change nothing, so the file is only rewritten after lookups or creations
+        if to_lookup or persons:
+            self.save()
+        return persons
+
+    def stats(self) -> Dict[str, int]:
+        return {"cache_hits": self.hits, "lookups": self.lookups, "created": self.created}
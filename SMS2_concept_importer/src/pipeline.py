@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+import traceback
+from typing import Optional, Dict, Any, List, Callable, Iterable
+
+from instrumentation import logger, metrics, span
+
+DEFAULT_QUEUE_SIZE = 16
+
+# Put on a queue once per worker of the receiving stage when no more items will follow
+_END = object()
+
+
+class Stage:
+    """One step of a pipeline: `fn(item)` runs on `workers` threads.
+
+    fn returns the item to hand on to the next stage, or None when the item is finished early (e.g. it was
+    already migrated). An exception moves the item to the dead-letter queue.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, queue_size: Optional[int] = None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.processed = 0
+        self.failed = 0
+        self.busy_s = 0.0
+        self.blocked_s = 0.0
+
+
+class Pipeline:
+    """Streams items through a chain of stages, each with its own bounded input queue and worker threads.
+
+    A stage starts on an item as soon as the previous stage hands it on, so the throughput is set by the
+    slowest stage instead of the sum of all stage latencies. Full queues block the stage in front of them
+    (back-pressure), so a slow stage never lets work pile up in memory.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = DEFAULT_QUEUE_SIZE,
+                 on_complete: Optional[Callable[[Any], None]] = None,
+                 on_failure: Optional[Callable[[Any, str, BaseException, str], None]] = None,
+                 name: Optional[str] = None):
+        self.stages = stages
+        self.name = name
+        self.queue_size = queue_size
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.dead_letters: List[Dict[str, Any]] = []
+        self._queues = [queue.Queue(maxsize=stage.queue_size or queue_size) for stage in stages]
+        self._remaining_workers = [stage.workers for stage in stages]
+        self._lock = threading.Lock()
+
+    def _put(self, index: int, item):
+        """Hands an item to stage `index` and accounts the time spent waiting for room in its queue."""
+        start = time.perf_counter()
+        self._queues[index].put(item)
+        waited = time.perf_counter() - start
+        if index:
+            with self._lock:
+                self.stages[index - 1].blocked_s += waited
+
+    def _finish(self, item):
+        if self.on_complete is not None:
+            try:
+                self.on_complete(item)
+            except Exception:
+                logger.exception("on_complete failed")
+
+    def _fail(self, item, stage: Stage, error: BaseException):
+        trace = traceback.format_exc()
+        with self._lock:
+            stage.failed += 1
+            self.dead_letters.append({"item": item, "stage": stage.name, "error": f"{type(error).__name__}: {error}",
+                                      "traceback": trace})
+        metrics.inc("pipeline_dead_letters_total", stage=stage.name)
+        if self.on_failure is not None:
+            try:
+                self.on_failure(item, stage.name, error, trace)
+            except Exception:
+                logger.exception("on_failure failed")
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        is_last = index == len(self.stages) - 1
+        while True:
+            item = inbox.get()
+            if item is _END:
+                break
+            start = time.perf_counter()
+            try:
+                with span(stage.name):
+                    result = stage.fn(item)
+            except Exception as e:
+                self._fail(item, stage, e)
+                continue
+            finally:
+                with self._lock:
+                    stage.busy_s += time.perf_counter() - start
+            with self._lock:
+                stage.processed += 1
+            if result is None or is_last:
+                self._finish(item if result is None else result)
+            else:
+                self._put(index + 1, result)
+
+        # The last worker of a stage to stop tells every worker of the next stage to stop
+        with self._lock:
+            self._remaining_workers[index] -= 1
+            last_worker = self._remaining_workers[index] == 0
+        if last_worker and not is_last:
+            for _ in range(self.stages[index + 1].workers):
+                self._queues[index + 1].put(_END)
+
+    def run(self, items: Iterable[Any]) -> List[Dict[str, Any]]:
+        """Processes all items and returns the dead letters (item, stage, error, traceback)."""
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread_name = "-".join(filter(None, [self.name, stage.name, str(n)]))
+                thread = threading.Thread(target=self._worker, args=(index,), name=thread_name, daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # Feeding blocks while the first stage is busy, so `items` may be a lazy iterator
+        for item in items:
+            self._put(0, item)
+        for _ in range(self.stages[0].workers):
+            self._queues[0].put(_END)
+        for thread in threads:
+            thread.join()
+        return self.dead_letters
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per stage: items processed and failed, time spent working and waiting for the next stage."""
+        return {
+            stage.name: {
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "failed": stage.failed,
+                "busy_s": round(stage.busy_s, 3),
+                "blocked_s": round(stage.blocked_s, 3),
+            }
+            for stage in self.stages
+        }
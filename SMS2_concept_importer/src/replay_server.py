@@ -0,0 +1,325 @@
+"""Local stand-in for the SMS2 and I14Y APIs, to run the migration offline.
+
+Responses recorded with SMS2_record=<cassette.ndjson> are replayed; requests that were not recorded get a
+synthetic answer (new concept ids for POSTs, empty successes for status PUTs, 404 for unknown persons).
+Latency, error rate and rate limits can be configured to measure and regression-test throughput.
+
+Usage:
+    python SMS2_concept_importer/src/replay_server.py --cassette run.ndjson --port 8765 --latency-ms 50
+    SMS2_api_override=http://127.0.0.1:8765 python SMS2_concept_importer/src/SMS2_batch_migration.py ...
+"""
+import argparse
+import codecs
+import json
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Callable, Tuple, Iterable
+from urllib.parse import urlsplit, parse_qs
+
+# (status, content type, body)
+Reply = Tuple[int, str, str]
+JSON = "application/json"
+# json.dumps(ensure_ascii=False) of a string, used to escape a streamed body chunk by chunk
+_encode_string = json.encoder.encode_basestring
+
+
+class CassetteRecorder:
+    """Appends every response of the ApiClient to an NDJSON cassette that replay_server.py can serve.
+
+    A streamed response is recorded once the caller has read its body: the chunks are spooled to a temporary
+    file while they are read, so a recorded run keeps streaming code lists. A body that is not read to its end
+    is not recorded. 304 responses have no body to replay and are skipped; record with an empty code list cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, method: str, url: str, response, stream: bool = False):
+        if response.status_code == 304:
+            return
+        parts = urlsplit(url)
+        line = {
+            "method": method,
+            "host": parts.netloc,
+            "path": parts.path,
+            # The query of the sent request includes the params passed separately (e.g. page/pageSize)
+            "query": urlsplit(response.url).query,
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", JSON),
+            "body": "",
+        }
+        if not stream:
+            line["body"] = response.text
+            self._write(json.dumps(line, ensure_ascii=False))
+            return
+
+        iter_content = response.iter_content
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+
+        def recording_iter_content(*args, **kwargs):
+            with tempfile.TemporaryFile("w+", encoding="utf-8") as body:
+                for chunk in iter_content(*args, **kwargs):
+                    text = chunk if isinstance(chunk, str) else decoder.decode(chunk)
+                    body.write(_encode_string(text)[1:-1])
+                    yield chunk
+                body.write(_encode_string(decoder.decode(b"", final=True))[1:-1])
+                # The escaped body goes between the quotes of the empty "body" placeholder, the last field
+                prefix, suffix = json.dumps(line, ensure_ascii=False).rsplit('""', 1)
+                body.seek(0)
+                with self._lock:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(prefix + '"')
+                        shutil.copyfileobj(body, f)
+                        f.write('"' + suffix + "\n")
+
+        response.iter_content = recording_iter_content
+
+    def _write(self, text: str):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(text + "\n")
+
+
+def load_cassettes(paths: Iterable[str]) -> Dict[Tuple[str, str, str, str], List[Reply]]:
+    recorded: Dict[Tuple[str, str, str, str], List[Reply]] = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["status"] == 304:
+                    continue  # Recorded with a warm cache by older versions, there is no body to replay
+                key = (entry["method"], entry["host"], entry["path"], entry.get("query", ""))
+                recorded.setdefault(key, []).append((entry["status"], entry.get("content_type", JSON), entry["body"]))
+    return recorded
+
+
+class _RateLimiter:
+    """Non-blocking token bucket per host: the stand-in answers 429 instead of waiting."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(host, [float(self.burst), now])
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[host] = [tokens - 1 if allowed else tokens, now]
+            return allowed
+
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server answering /<original host>/<original path> like the real SMS2 and I14Y APIs."""
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), cassettes: Iterable[str] = (), latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, rate_limit: Optional[float] = None,
+                 burst: int = 10, seed: Optional[int] = None):
+        super().__init__(address, _Handler)
+        self.recorded = load_cassettes(cassettes)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limiter = _RateLimiter(rate_limit, burst) if rate_limit else None
+        self.random = random.Random(seed)
+        self.routes: List[Tuple[str, re.Pattern, Callable]] = []
+        self.concepts: Dict[str, Any] = {}
+        # Registration status and publication level per concept id, set by the PUT endpoints
+        self.concept_states: Dict[str, Dict[str, str]] = {}
+        self.persons: Dict[str, Any] = {}
+        self.stats: Dict[str, int] = {"requests": 0, "replayed": 0, "synthetic": 0, "errors": 0, "throttled": 0}
+        self._replay_position: Dict[Tuple[str, str, str, str], int] = {}
+        self._lock = threading.Lock()
+        self._add_default_routes()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_route(self, method: str, pattern: str, handler: Callable[..., Reply]):
+        """Adds a synthetic endpoint. handler(server, match, query, body) returns (status, content type, body).
+
+        Routes added later take precedence, so they can replace the defaults.
+        """
+        self.routes.insert(0, (method, re.compile(pattern), handler))
+
+    def _add_default_routes(self):
+        def post_concept(server, match, query, body):
+            concept_id = str(uuid.uuid4())
+            with server._lock:
+                server.concepts[concept_id] = json.loads(body or b"null")
+            return 201, JSON, json.dumps(concept_id)
+
+        def get_person(server, match, query, body):
+            email = match.group(1).lstrip("/")
+            if email in server.persons:
+                return 200, JSON, json.dumps(server.persons[email])
+            return 404, JSON, ""
+
+        def post_persons(server, match, query, body):
+            persons = json.loads(body or b"[]")
+            with server._lock:
+                for person in persons if isinstance(persons, list) else [persons]:
+                    server.persons[person.get("email")] = person
+            return 200, JSON, ""
+
+        def list_concepts(server, match, query, body):
+            return 200, JSON, json.dumps({"data": []})
+
+        def find_concepts(server, match, query, body):
+            identifier = query.get("conceptIdentifier", [None])[0]
+            version = query.get("version", [None])[0]
+            with server._lock:
+                # Posted payloads are {"data": <concept>}
+                concepts = {concept_id: (payload or {}).get("data") or {}
+                            for concept_id, payload in server.concepts.items() if isinstance(payload, dict)}
+                states = dict(server.concept_states)
+            found = [
+                {"id": concept_id, "identifier": concept.get("identifier"), "version": concept.get("version"),
+                 "conceptType": concept.get("conceptType"),
+                 "registrationStatus": states.get(concept_id, {}).get("registrationStatus", "Incomplete"),
+                 "publicationLevel": states.get(concept_id, {}).get("publicationLevel", "Internal")}
+                for concept_id, concept in concepts.items()
+                if identifier in (None, concept.get("identifier")) and version in (None, concept.get("version"))
+            ]
+            if "page" in query:
+                page, page_size = int(query["page"][0]), int(query.get("pageSize", ["1000"])[0])
+                found = found[(page - 1) * page_size:page * page_size]
+            return 200, JSON, json.dumps({"data": found})
+
+        def set_state(server, match, query, body):
+            concept_id, action = match.groups()
+            field, value = ("registrationStatus", query.get("status", [None])[0]) \
+                if action == "registration-status" else ("publicationLevel", query.get("level", [None])[0])
+            with server._lock:
+                server.concept_states.setdefault(concept_id, {})[field] = value
+            return 200, JSON, ""
+
+        def ok(server, match, query, body):
+            return 200, JSON, ""
+
+        self.add_route("GET", r"/api/public/v1/concepts$", list_concepts)
+        self.add_route("GET", r"/api/partner/v1/concepts$", find_concepts)
+        self.add_route("PUT", r"/concepts/([^/]+)/(registration-status|publication-level)$", set_state)
+        self.add_route("POST", r"/concepts/[^/]+/codelist-entries/imports/json$", ok)
+        self.add_route("POST", r"/api/Persons/?$", post_persons)
+        self.add_route("GET", r"/api/Persons(/?.+)$", get_person)
+        self.add_route("POST", r"/api/concepts$", post_concept)
+
+    def reply(self, method: str, path: str, query: str, body: bytes) -> Tuple[Reply, Dict[str, str]]:
+        """Computes the answer to one request: throttling, injected errors, replay, then synthetic routes."""
+        host, _, rest = path.lstrip("/").partition("/")
+        rest = "/" + rest
+        with self._lock:
+            self.stats["requests"] += 1
+
+        delay = self.latency_ms + (self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if self.rate_limiter is not None and not self.rate_limiter.allow(host):
+            with self._lock:
+                self.stats["throttled"] += 1
+            return (429, JSON, ""), {"Retry-After": "1"}
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            return (503, JSON, ""), {}
+
+        key = (method, host, rest, query)
+        if key in self.recorded:
+            with self._lock:
+                replies = self.recorded[key]
+                position = self._replay_position.get(key, 0)
+                self._replay_position[key] = position + 1
+                self.stats["replayed"] += 1
+            # Repeated requests get the recorded responses in order, then the last one again
+            return replies[min(position, len(replies) - 1)], {}
+
+        for route_method, pattern, handler in self.routes:
+            match = pattern.search(rest)
+            if route_method == method and match:
+                with self._lock:
+                    self.stats["synthetic"] += 1
+                return handler(self, match, parse_qs(query), body), {}
+        return (404, JSON, ""), {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle's algorithm the body of a keep-alive response waits
+    # for the delayed ACK of the headers (~40 ms), which would dominate every benchmark
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+            body = b""  # Uploaded files are accepted but not parsed
+        (status, content_type, text), headers = self.server.reply(self.command, parts.path, parts.query, body)
+
+        payload = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int = 0, **kwargs) -> StandInServer:
+    """Starts a stand-in server on a background thread and returns it (see `server.url`)."""
+    server = StandInServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="stand-in-server", daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the SMS2 and I14Y APIs.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cassette", action="append", default=[], help="NDJSON file recorded with SMS2_record")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requests per second per host (429 above)")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = StandInServer(("127.0.0.1", args.port), cassettes=args.cassette, latency_ms=args.latency_ms,
+                           jitter_ms=args.jitter_ms, error_rate=args.error_rate, rate_limit=args.rate_limit,
+                           burst=args.burst, seed=args.seed)
+    print(f"Stand-in API listening on {server.url} "
+          f"({sum(len(r) for r in server.recorded.values())} recorded responses)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Requests:", server.stats)
+
+
+if __name__ == "__main__":
+    main()
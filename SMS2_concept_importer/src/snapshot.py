@@ -0,0 +1,162 @@
+"""Compact columnar snapshots of a catalogue index, for diffs without downloading the catalogues again.
+
+A snapshot stores what diff_engine.build_index keeps of every item: identifier, version, id and the
+optional field hashes, sorted by (identifier, version). Layout:
+
+    b"SMS2SNAP" | header length (uint32 LE) | JSON header | column data
+
+Every string column is a UTF-8 blob of NUL-terminated strings; the hash column
+holds the raw field hashes of every item (diff_engine.field_hashes, `width` bytes each). The file is
+memory-mapped and every column is decoded in one go.
+"""
+import json
+import mmap
+import os
+import time
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+MAGIC = b"SMS2SNAP"
+# Format 1 snapshots hold one SHA-1 over all drift fields, which cannot be compared with field hashes;
+# they are still read, without fingerprints
+FORMAT_VERSION = 2
+READABLE_FORMATS = (1, 2)
+STRING_COLUMNS = ("identifier", "version", "id")
+
+Key = Tuple[str, str]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _string_column(values: Iterable[Optional[str]]) -> bytes:
+    """Returns the blob of a string column; None is stored as an empty string."""
+    return b"".join((value or "").encode("utf-8") + b"\0" for value in values)
+
+
+def write_snapshot(path: str, index: Dict[Key, Dict[str, Any]], source: str,
+                   fingerprint_fields: Optional[Iterable[str]] = None) -> int:
+    """Writes a build_index result to `path` and returns the number of items.
+
+    fingerprint_fields names the fields the "hash" values were computed from (None if the index has none),
+    so a snapshot is only used for drift detection with the same fields.
+    """
+    keys = sorted(index)
+    has_hash = fingerprint_fields is not None and all(index[key].get("hash") for key in keys)
+    columns = {
+        "identifier": _string_column(identifier for identifier, _ in keys),
+        "version": _string_column(version for _, version in keys),
+        "id": _string_column(index[key].get("id") for key in keys),
+    }
+    hashes = b"".join(bytes.fromhex(index[key]["hash"]) for key in keys) if has_hash else None
+    width = len(hashes) // len(keys) if hashes else 0
+
+    header = {
+        "format": FORMAT_VERSION,
+        "source": source,
+        "created_at": time.time(),
+        "count": len(keys),
+        "fingerprint_fields": list(fingerprint_fields) if has_hash else None,
+        "columns": {},
+    }
+    # Column positions are relative to the end of the header, so the header can be written first
+    chunks = []
+    position = 0
+    for name in STRING_COLUMNS:
+        blob = columns[name]
+        header["columns"][name] = {"blob": [position, len(blob)]}
+        chunks.append(blob)
+        position += len(blob)
+    if hashes is not None:
+        header["columns"]["hash"] = {"fixed": [position, len(hashes)], "width": width}
+        chunks.append(hashes)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    tmp_path = path + ".tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+    return len(keys)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot written by write_snapshot."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+        if self._mmap is None or self._mmap[:len(MAGIC)] != MAGIC:
+            raise SnapshotError(f"{path} is not a catalogue snapshot")
+        header_length = int.from_bytes(self._mmap[8:12], "little")
+        self.header = json.loads(self._mmap[12:12 + header_length])
+        if self.header.get("format") not in READABLE_FORMATS:
+            raise SnapshotError(f"{path} has the unsupported snapshot format {self.header.get('format')}")
+        self._data = memoryview(self._mmap)[12 + header_length:]
+        self.count: int = self.header["count"]
+        self.source: str = self.header["source"]
+        self.created_at: float = self.header["created_at"]
+        hash_column = self.header["columns"].get("hash") if self.header["format"] == FORMAT_VERSION else None
+        self.fingerprint_fields: Optional[List[str]] = self.header["fingerprint_fields"] if hash_column else None
+
+        self._blobs = {}
+        for name in STRING_COLUMNS:
+            position, length = self.header["columns"][name]["blob"]
+            self._blobs[name] = self._data[position:position + length]
+        self._hashes = self._data[hash_column["fixed"][0]:sum(hash_column["fixed"])] if hash_column else None
+        self._hash_width = hash_column["width"] if hash_column else 0
+
+    @property
+    def has_fingerprints(self) -> bool:
+        return self._hashes is not None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._blobs.clear()
+        self._hashes = None
+        self._data.release()
+        self._mmap.close()
+
+    def column(self, name: str) -> List[str]:
+        """Decodes a whole string column at once."""
+        if not self.count:
+            return []
+        return str(self._blobs[name], "utf-8")[:-1].split("\0")
+
+    def index(self) -> Dict[Key, Dict[str, Any]]:
+        """Returns the snapshot as a build_index result, ready for diff_engine.migration_plan."""
+        identifiers = self.column("identifier")
+        versions = self.column("version")
+        ids = self.column("id")
+        if self._hashes is None:
+            return {(identifier, version): {"id": item_id or None}
+                    for identifier, version, item_id in zip(identifiers, versions, ids)}
+        hashes = bytes(self._hashes).hex()
+        width = 2 * self._hash_width
+        return {
+            (identifier, version): {"id": item_id or None, "hash": hashes[i * width:(i + 1) * width]}
+            for i, (identifier, version, item_id) in enumerate(zip(identifiers, versions, ids))
+        }
+
+
+def load_index(path: str, fingerprint_fields: Optional[Iterable[str]] = None) -> Dict[Key, Dict[str, Any]]:
+    """Reads the index of a snapshot. With fingerprint_fields, the snapshot must contain field hashes
+    of the same fields."""
+    with Snapshot(path) as snapshot:
+        if fingerprint_fields is not None and snapshot.fingerprint_fields != list(fingerprint_fields):
+            raise SnapshotError(f"{path} has no content fingerprints of the fields {', '.join(fingerprint_fields)}, "
+                                f"create it with --drift")
+        return snapshot.index()
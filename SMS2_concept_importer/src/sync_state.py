@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, Iterable, Iterator
+
+DEFAULT_STATE_PATH = "SMS2_concept_importer/state/sync_state.sqlite"
+
+
+class SyncState:
+    """Persistent record of the DVs that were migrated to each I14Y environment.
+
+    One row per (environment, identifier, version) with the SMS2 DV id, the I14Y concept id returned by
+    post_DV and the time of the sync.
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """CREATE TABLE IF NOT EXISTS concepts (
+                   environment TEXT NOT NULL,
+                   identifier TEXT NOT NULL,
+                   version TEXT NOT NULL,
+                   dv_id TEXT NOT NULL,
+                   concept_id TEXT NOT NULL,
+                   synced_at REAL NOT NULL,
+                   PRIMARY KEY (environment, identifier, version)
+               );
+               CREATE INDEX IF NOT EXISTS concepts_dv_id ON concepts (environment, dv_id);"""
+        )
+        self._db.commit()
+
+    def record(self, environment: str, identifier: str, version: str, dv_id: str, concept_id: str):
+        """Stores a migrated DV. Called right after post_DV so a crash never loses a posted concept."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO concepts "
+                "(environment, identifier, version, dv_id, concept_id, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (environment, identifier, version, dv_id, concept_id, time.time()))
+            self._db.commit()
+
+    def get_by_dv_id(self, environment: str, dv_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT identifier, version, concept_id, synced_at FROM concepts "
+                "WHERE environment = ? AND dv_id = ?", (environment, dv_id)).fetchone()
+        if row is None:
+            return None
+        return {"identifier": row[0], "version": row[1], "concept_id": row[2], "synced_at": row[3]}
+
+    def synced_keys(self, environment: str) -> set:
+        """Returns all (identifier, version) pairs already migrated to an environment."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT identifier, version FROM concepts WHERE environment = ?", (environment,)).fetchall()
+        return {(identifier, version) for identifier, version in rows}
+
+    def pending(self, environment: str, items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Yields the catalogue items whose (identifier, version) has not been migrated yet.
+
+        The SMS2 listing has no change timestamp, so a new version is what marks a DV as changed.
+        """
+        synced = self.synced_keys(environment)
+        for item in items:
+            if (item.get("identifier"), item.get("version")) not in synced:
+                yield item
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+import api_client  # noqa: E402
+import codelist_cache  # noqa: E402
+import SMS2_concept_importer as importer  # noqa: E402
+from bench_migration import install_sms2_routes  # noqa: E402
+from person_resolver import PersonResolver  # noqa: E402
+from replay_server import start_server  # noqa: E402
+from synthetic_data import generate_catalogue  # noqa: E402
+
+
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    """Stand-in server with a small synthetic SMS2 catalogue; client, caches and state live in tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    catalogue = generate_catalogue(12, [20, 50], 2)
+    server = start_server()
+    install_sms2_routes(server, catalogue)
+    unlimited = {group: (1e6, 10**6) for group in set(api_client.RATE_LIMIT_GROUPS.values())}
+    client = api_client.ApiClient(base_override=server.url, rate_limits=unlimited)
+    monkeypatch.setattr(api_client, "_client", client)
+    monkeypatch.setattr(codelist_cache, "_cache", codelist_cache.CodeListCache(str(tmp_path / "codelists.sqlite")))
+    monkeypatch.setattr(importer, "_person_resolver",
+                        PersonResolver(importer.get_Person, importer.post_Person, path=None))
+    server.catalogue = catalogue
+    yield server
+    client.close()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,56 @@
+import json
+
+from replay_server import JSON
+
+import SMS2_batch_migration as batch
+from migration_journal import MigrationJournal
+from sync_state import SyncState
+
+
+def run_main(tmp_path, *args):
+    reports = tmp_path / "batch_report.json"
+    exit_code = batch.main([*args, "--journal", str(tmp_path / "journal.sqlite"),
+                            "--state", str(tmp_path / "state.sqlite"), "--report", str(reports),
+                            "--dead-letters", str(tmp_path / "dead_letters.json")])
+    results = {}
+    for environment in ("DEV", "PROD"):
+        with open(tmp_path / f"batch_report_{environment}.json", encoding="utf-8") as f:
+            results[environment] = json.load(f)["results"]
+    return exit_code, results
+
+
+def test_resume_only_in_the_interrupted_environment(stand_in, tmp_path):
+    dv_id = next(iter(stand_in.catalogue["DVs"]))
+    journal = MigrationJournal(str(tmp_path / "journal.sqlite"))
+    journal.begin("DEV", dv_id, "post_concept")
+    journal.close()
+
+    exit_code, results = run_main(tmp_path, "--resume", "--environment", "DEV", "PROD")
+
+    assert exit_code == 0
+    assert [(r["dv_id"], r["status"]) for r in results["DEV"]] == [(dv_id, "migrated")]
+    assert results["PROD"] == []
+    assert len(stand_in.concepts) == 1
+
+
+def test_incremental_lists_the_catalogue_once(stand_in, tmp_path):
+    DVs = list(stand_in.catalogue["DVs"].values())
+    listings = []
+
+    def list_dvs(server, match, query, body):
+        listings.append(query)
+        page, page_size = int(query["page"][0]), int(query["pageSize"][0])
+        return 200, JSON, json.dumps(DVs[(page - 1) * page_size:page * page_size])
+
+    stand_in.add_route("GET", r"/api/DefinedVariables$", list_dvs)
+    state = SyncState(str(tmp_path / "state.sqlite"))
+    state.record("PROD", DVs[0]["identifier"], DVs[0]["version"], DVs[0]["id"], "existing-concept")
+    state.close()
+
+    exit_code, results = run_main(tmp_path, "--incremental", "--environment", "DEV", "PROD")
+
+    assert exit_code == 0
+    assert [query["page"] for query in listings].count(["1"]) == 1
+    assert sorted(r["dv_id"] for r in results["DEV"]) == sorted(DV["id"] for DV in DVs)
+    assert sorted(r["dv_id"] for r in results["PROD"]) == sorted(DV["id"] for DV in DVs[1:])
+    assert all(r["status"] == "migrated" for r in results["DEV"] + results["PROD"])
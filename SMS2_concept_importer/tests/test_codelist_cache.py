@@ -0,0 +1,27 @@
+import codelist_cache
+import SMS2_concept_importer as importer
+
+
+def test_streamed_code_list_entries_are_cached(stand_in):
+    cl_id, codelist = next(iter(stand_in.catalogue["codelists"].items()))
+    version = codelist["CL"]["version"]
+    requests = []
+    reply = stand_in.reply
+
+    def counting_reply(method, path, query, body):
+        if path.endswith("/codeListEntries"):
+            requests.append(path)
+        return reply(method, path, query, body)
+
+    stand_in.reply = counting_reply
+    cache = codelist_cache.get_cache()
+
+    first = importer.get_CLE_entries(cl_id, None, version)
+    assert len(first) == len(codelist["CLE"])
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache._load(f"CLE:{cl_id}:{version}") is not None
+
+    second = importer.get_CLE_entries(cl_id, None, version)
+    assert len(second) == len(first)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(requests) == 1
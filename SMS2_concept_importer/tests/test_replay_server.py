@@ -0,0 +1,43 @@
+import json
+
+import api_client
+from replay_server import CassetteRecorder, JSON, load_cassettes, start_server
+
+SMS2_CODELISTS = "https://sms-be.sis.bfs.admin.ch/api/CodeLists"
+
+
+def test_streamed_response_is_recorded_once_read(stand_in, tmp_path):
+    cassette = tmp_path / "run.ndjson"
+    client = api_client.get_client()
+    client.recorder = CassetteRecorder(str(cassette))
+    cl_id = next(iter(stand_in.catalogue["codelists"]))
+    url = f"{SMS2_CODELISTS}/{cl_id}/codeListEntries"
+
+    response = client.request("GET", url, stream=True)
+    assert not cassette.exists()
+    body = b"".join(response.iter_content(64))
+    assert json.loads(body)
+
+    replay = start_server(cassettes=[str(cassette)])
+    replay_client = api_client.ApiClient(base_override=replay.url)
+    try:
+        assert replay_client.request("GET", url).content == body
+        assert replay.stats["replayed"] == 1
+    finally:
+        replay_client.close()
+        replay.shutdown()
+        replay.server_close()
+
+
+def test_not_modified_responses_are_not_replayed(stand_in, tmp_path):
+    cassette = tmp_path / "run.ndjson"
+    api_client.get_client().recorder = CassetteRecorder(str(cassette))
+    stand_in.add_route("GET", r"/api/CodeLists/unchanged$", lambda server, match, query, body: (304, JSON, ""))
+
+    assert api_client.get_client().request("GET", f"{SMS2_CODELISTS}/unchanged").status_code == 304
+    assert not cassette.exists()
+
+    # Cassettes of older versions can contain 304s
+    cassette.write_text(json.dumps({"method": "GET", "host": "sms-be.sis.bfs.admin.ch", "path": "/api/CodeLists/x",
+                                    "query": "", "status": 304, "content_type": JSON, "body": ""}) + "\n")
+    assert load_cassettes([str(cassette)]) == {}